@@ -0,0 +1,239 @@
+"""
+Time the metrics, graph and visual tools on a list-builds JSON file,
+for instance one written by generate_builds.py, and keep a history of
+results so regressions between versions stand out.
+
+Each benchmark runs in its own process so its peak memory can be
+measured. Peak memory includes any untimed setup, such as building the
+tree before timing trim_excess_tags.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from common import iter_builds
+
+
+def _get_stats(inputfile):
+    import metrics
+    with open(inputfile) as fp:
+        builds = metrics.Builds(iter_builds(fp))
+        start = time.time()
+        builds.get_stats()
+        return time.time() - start
+
+
+def _build_tree(inputfile):
+    import graph
+    with open(inputfile) as fp:
+        builds = iter_builds(fp)
+        start = time.time()
+        tree = graph.BuildTree(builds, None)
+        return time.time() - start, tree
+
+
+def _build_tree_time(inputfile):
+    return _build_tree(inputfile)[0]
+
+
+def _trim_excess_tags(inputfile):
+    tree = _build_tree(inputfile)[1]
+    start = time.time()
+    tree.trim_excess_tags()
+    return time.time() - start
+
+
+def _as_graph_easy_txt(inputfile):
+    tree = _build_tree(inputfile)[1]
+    tree.trim_excess_tags()
+    start = time.time()
+    tree.as_graph_easy_txt(include_datestamp=True,
+                           include_duration=True,
+                           include_upload=True)
+    return time.time() - start
+
+
+def _write_dot(inputfile):
+    tree = _build_tree(inputfile)[1]
+    tree.trim_excess_tags()
+    with open(os.devnull, 'w') as fp:
+        start = time.time()
+        tree.write_dot(fp, include_datestamp=True, include_duration=True,
+                       include_upload=True)
+        return time.time() - start
+
+
+def _load_charts(inputfile):
+    import visual
+    _get_stats(inputfile)
+    start = time.time()
+    visual.Charts('metrics-current.csv', 'metrics-concurrent.csv')
+    return time.time() - start
+
+
+BENCHMARKS = [
+    ('Builds.get_stats', _get_stats),
+    ('BuildTree', _build_tree_time),
+    ('BuildTree.trim_excess_tags', _trim_excess_tags),
+    ('BuildTree.as_graph_easy_txt', _as_graph_easy_txt),
+    ('BuildTree.write_dot', _write_dot),
+    ('visual.Charts', _load_charts),
+]
+
+
+def _run_benchmark(benchmark, inputfile, workdir, queue):
+    os.chdir(workdir)
+    try:
+        seconds = benchmark(inputfile)
+    except ImportError as e:
+        queue.put({'skipped': repr(e)})
+        return
+    except Exception as e:
+        queue.put({'failed': repr(e)})
+        return
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({'seconds': seconds, 'peak_rss_kb': peak})
+
+
+def run_benchmarks(inputfile, names=None):
+    inputfile = os.path.abspath(inputfile)
+    with open(inputfile) as fp:
+        nbuilds = sum(1 for build in iter_builds(fp))
+
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        workdir = tempfile.mkdtemp(prefix='osbs-metrics-benchmark-')
+        try:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_run_benchmark,
+                                              args=(benchmark, inputfile,
+                                                    workdir, queue))
+            process.start()
+            result = None
+            while result is None:
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    # Killed, or crashed in a way it could not report
+                    if process.exitcode is not None and queue.empty():
+                        result = {'failed': 'exit code %s' % process.exitcode}
+            process.join()
+        finally:
+            shutil.rmtree(workdir)
+
+        if 'seconds' in result:
+            result['builds_per_second'] = nbuilds / max(result['seconds'], 1e-9)
+
+        results[name] = result
+        sys.stderr.write("%s: %s\n" % (name, result))
+
+    return nbuilds, results
+
+
+def get_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous, current, threshold):
+    """
+    Print timings against a previous history entry, returning the
+    names of benchmarks which failed or got slower by more than threshold
+    """
+    regressions = []
+    print("%-30s %10s %10s %8s %12s" % ('benchmark', 'previous', 'seconds',
+                                        'change', 'peak RSS kB'))
+    for name, result in sorted(current['results'].items()):
+        if 'failed' in result:
+            print("%-30s failed: %s" % (name, result['failed']))
+            regressions.append(name)
+            continue
+
+        if 'seconds' not in result:
+            print("%-30s skipped: %s" % (name, result['skipped']))
+            continue
+
+        before = previous['results'].get(name, {}).get('seconds') if previous else None
+        if before:
+            change = (result['seconds'] - before) / before
+            flag = ''
+            if change > threshold:
+                flag = ' !'
+                regressions.append(name)
+
+            print("%-30s %10.3f %10.3f %+7.1f%% %12d%s" % (
+                name, before, result['seconds'], change * 100,
+                result['peak_rss_kb'], flag))
+        else:
+            print("%-30s %10s %10.3f %8s %12d" % (
+                name, '-', result['seconds'], '', result['peak_rss_kb']))
+
+    return regressions
+
+
+def run(inputfile, historyfile, names=None, threshold=0.1):
+    nbuilds, results = run_benchmarks(inputfile, names)
+    entry = {
+        'version': get_version(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'input': os.path.basename(inputfile),
+        'builds': nbuilds,
+        'results': results,
+    }
+
+    # Compare against the latest run over the same number of builds
+    previous = None
+    if os.path.exists(historyfile):
+        with open(historyfile) as fp:
+            for line in fp:
+                past = json.loads(line)
+                if past['builds'] == nbuilds:
+                    previous = past
+
+    if previous:
+        print("Compared with %s (%s)" % (previous['version'], previous['date']))
+    regressions = compare(previous, entry, threshold)
+
+    with open(historyfile, 'a') as fp:
+        fp.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", default="benchmark-history.jsonl",
+                        help="file to append results to")
+    parser.add_argument("--benchmark", action='append',
+                        choices=[name for name, benchmark in BENCHMARKS],
+                        help="only run this benchmark, may be repeated")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown counted as a regression")
+    parser.add_argument("inputfile")
+    args = parser.parse_args()
+
+    regressions = run(args.inputfile, args.history, args.benchmark,
+                      args.threshold)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,141 @@
+"""
+Helpers shared by the metrics, graph, visual and zabbix tools.
+"""
+
+from calendar import timegm
+import datetime
+import json
+import os
+import re
+from time import strptime
+
+
+RFC3339_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Format used for timestamps in the metrics CSV files
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+_rfc3339_cache = {}
+RFC3339_CACHE_SIZE = 1 << 16
+
+
+def rfc3339_time(rfc3339):
+    """
+    Seconds since the epoch for an RFC3339 UTC timestamp
+    """
+    try:
+        return _rfc3339_cache[rfc3339]
+    except KeyError:
+        pass
+
+    if (len(rfc3339) == 20 and rfc3339[19] == 'Z' and
+            rfc3339[4] == rfc3339[7] == '-' and rfc3339[10] == 'T' and
+            rfc3339[13] == rfc3339[16] == ':'):
+        seconds = timegm((int(rfc3339[0:4]), int(rfc3339[5:7]),
+                          int(rfc3339[8:10]), int(rfc3339[11:13]),
+                          int(rfc3339[14:16]), int(rfc3339[17:19])))
+    else:
+        seconds = timegm(strptime(rfc3339, RFC3339_FORMAT))
+
+    if len(_rfc3339_cache) >= RFC3339_CACHE_SIZE:
+        _rfc3339_cache.clear()
+
+    _rfc3339_cache[rfc3339] = seconds
+    return seconds
+
+
+def rfc3339_datetime(rfc3339, tz=None):
+    """
+    datetime for an RFC3339 UTC timestamp, in tz if given
+    """
+    return datetime.datetime.fromtimestamp(rfc3339_time(rfc3339), tz)
+
+
+def iter_builds(fp, chunk_size=1 << 16):
+    """
+    Yield builds one at a time from 'osbs --output=json list-builds'
+    output without loading the whole document.
+
+    Both a top-level JSON array and a stream of concatenated objects
+    are accepted.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    eof = False
+    started = False
+    while True:
+        buf = buf[_SEPARATORS.match(buf).end():]
+        if buf and not started:
+            started = True
+            if buf[0] == '[':
+                buf = buf[1:]
+                continue
+
+        if buf.startswith(']'):
+            return
+
+        if buf:
+            try:
+                build, end = decoder.raw_decode(buf)
+            except ValueError:
+                # Incomplete object, read some more
+                if eof:
+                    raise
+            else:
+                yield build
+                buf = buf[end:]
+                continue
+
+        if eof:
+            return
+
+        # Read at least as much again as is buffered, so an object
+        # spanning many chunks is only re-parsed a few times
+        chunk = fp.read(max(chunk_size, len(buf)))
+        if not chunk:
+            eof = True
+
+        buf += chunk
+
+
+def slim_build(build, annotations=()):
+    """
+    Return a copy of build holding only the fields the tools read,
+    plus the named annotations, so the rest can be freed.
+    """
+    metadata = build.get('metadata', {})
+    status = build.get('status', {})
+    slim = {
+        'metadata': {key: metadata[key]
+                     for key in ('name', 'creationTimestamp')
+                     if key in metadata},
+        'status': {key: status[key]
+                   for key in ('phase', 'startTimestamp',
+                               'completionTimestamp', 'duration')
+                   if key in status},
+    }
+    if 'annotations' in metadata:
+        slim['metadata']['annotations'] = {
+            key: metadata['annotations'][key]
+            for key in annotations
+            if key in metadata['annotations']}
+
+    return slim
+
+
+def columnar_parts(filename):
+    """
+    filename and the parts appended to it by incremental runs of
+    'metrics.py --format columnar', in the order they were written
+    """
+    base, ext = os.path.splitext(filename)
+    directory, prefix = os.path.split(base + '.')
+    parts = []
+    for entry in os.listdir(directory or '.'):
+        number = entry[len(prefix):-len(ext)]
+        if (entry.startswith(prefix) and entry.endswith(ext) and
+                number.isdigit()):
+            parts.append((int(number), os.path.join(directory, entry)))
+
+    return [filename] + [part for number, part in sorted(parts)]
@@ -0,0 +1,186 @@
+"""
+Generate synthetic 'osbs --output=json list-builds' output for
+benchmarking, with base image dependency chains and the annotations
+the tools read.
+"""
+
+import argparse
+import json
+import random
+import sys
+from time import gmtime, strftime
+
+from common import RFC3339_FORMAT
+
+
+PLUGIN_DURATIONS = [
+    # plugin, median seconds
+    ('pull_base_image', 60),
+    ('distgit_fetch_artefacts', 5),
+    ('dockerfile_content', 300),
+    ('squash', 90),
+    ('compress', 60),
+    ('pulp_push', 120),
+]
+FAILURES = [
+    ('pull_base_image', 'RuntimeError("unable to pull base image (timeout)")'),
+    ('dockerfile_content', 'RuntimeError("docker build failed (exit code 1)")'),
+    ('pulp_push', 'ConnectionError("pulp push failed (retries exhausted)")'),
+]
+REGISTRY = 'registry.example.com'
+ROOT_IMAGES = ['rhel7:7.2', 'rhel7:7.3', 'rhel-atomic:7.3']
+
+
+def rfc3339(timestamp):
+    return strftime(RFC3339_FORMAT, gmtime(timestamp))
+
+
+class Image(object):
+    def __init__(self, name, base):
+        self.name = name
+        self.base = base  # Image or root image tag
+        self.version = '1.%d' % random.randint(0, 9)
+        self.release = 0
+        self.size = int(random.lognormvariate(18, 1.2))
+
+    def tag(self):
+        return '%s:%s-%d' % (self.name, self.version, self.release)
+
+    def base_image_name(self):
+        if not isinstance(self.base, Image):
+            return self.base
+        if random.random() < 0.7:
+            return '%s/%s:latest' % (REGISTRY, self.base.name)
+        return '%s/%s' % (REGISTRY, self.base.tag())
+
+
+def make_images(count):
+    """
+    Images where each is built on a root image or an earlier image,
+    so dependency chains form a forest a few levels deep
+    """
+    images = []
+    for index in range(count):
+        name = 'rhel7/image-%d' % index
+        if images and random.random() < 0.6:
+            # Prefer recent images so chains get deeper
+            base = images[int(len(images) * random.random() ** 0.5)]
+        else:
+            base = random.choice(ROOT_IMAGES)
+
+        images.append(Image(name, base))
+
+    return images
+
+
+def make_build(number, image, created):
+    name = '%s-%d' % (image.name.split('/')[-1], number)
+    pending = random.expovariate(1 / 30.0)
+    if random.random() < 0.01:
+        # Archived builds have a start before their creation
+        pending = -random.randint(1, 3600)
+
+    start = created + int(pending)
+    durations = {}
+    for plugin, median in PLUGIN_DURATIONS:
+        durations[plugin] = random.lognormvariate(0, 0.5) * median
+
+    running = sum(durations.values()) + random.uniform(10, 60)
+    completion = start + int(running)
+    phase = 'Complete'
+    errors = {}
+    roll = random.random()
+    if roll < 0.08:
+        phase = 'Failed'
+        plugin, error = random.choice(FAILURES)
+        errors[plugin] = error
+    elif roll < 0.1:
+        phase = 'Cancelled'
+
+    image.release += 1
+    unique = '%s/%s:%s-%s' % (REGISTRY, image.name, name,
+                              '%08x' % random.getrandbits(32))
+    primary = ['%s/%s' % (REGISTRY, image.tag()),
+               '%s/%s:%s' % (REGISTRY, image.name, image.version),
+               '%s/%s:latest' % (REGISTRY, image.name)]
+    size = int(image.size * random.uniform(0.95, 1.05))
+    annotations = {
+        'base-image-name': image.base_image_name(),
+        'image-id': '%064x' % random.getrandbits(256),
+        'plugins-metadata': json.dumps({
+            'durations': durations,
+            'errors': errors,
+            'timestamps': {plugin: rfc3339(start) for plugin in durations},
+        }),
+        'repositories': json.dumps({
+            'unique': [unique] if phase == 'Complete' else [],
+            'primary': primary if phase == 'Complete' else [],
+        }),
+        'tar_metadata': json.dumps({
+            'size': size,
+            'md5sum': '%032x' % random.getrandbits(128),
+            'filename': '%s.tar' % name,
+        }),
+    }
+    build = {
+        'kind': 'Build',
+        'metadata': {
+            'name': name,
+            'namespace': 'default',
+            'creationTimestamp': rfc3339(created),
+            'annotations': annotations,
+            'labels': {'buildconfig': image.name.split('/')[-1]},
+        },
+        'spec': {
+            'source': {'git': {'uri': 'git://git.example.com/%s' % image.name,
+                               'ref': '%040x' % random.getrandbits(160)}},
+            'strategy': {'customStrategy': {'from': {'name': 'buildroot:latest'}}},
+        },
+        'status': {
+            'phase': phase,
+            'startTimestamp': rfc3339(start),
+            'completionTimestamp': rfc3339(completion),
+            'duration': int(running) * 10**9,
+        },
+    }
+    return build
+
+
+def generate(fp, nbuilds, nimages, start, rate, seed=None):
+    """
+    Write nbuilds builds as a JSON array, arriving on average rate
+    builds per hour from start (seconds since the epoch)
+    """
+    random.seed(seed)
+    images = make_images(nimages)
+    created = start
+    fp.write('[\n')
+    for number in range(nbuilds):
+        created += random.expovariate(rate / 3600.0)
+        build = make_build(number, random.choice(images), int(created))
+        if number:
+            fp.write(',\n')
+        json.dump(build, fp)
+
+    fp.write('\n]\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--builds", type=int, default=10000)
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--start", type=int, default=1456444800,
+                        help="seconds since the epoch of the first build")
+    parser.add_argument("--rate", type=float, default=20,
+                        help="builds created per hour")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("outputfile", nargs='?', default=None)
+    args = parser.parse_args()
+
+    if args.outputfile is not None:
+        with open(args.outputfile, 'w') as fp:
+            generate(fp, args.builds, args.images, args.start, args.rate,
+                     args.seed)
+    else:
+        generate(sys.stdout, args.builds, args.images, args.start, args.rate,
+                 args.seed)
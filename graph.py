@@ -1,12 +1,31 @@
-from collections import defaultdict
+import argparse
+from collections import defaultdict, namedtuple
 import json
 from osbs.utils import strip_registry_from_image
+import os
 import sys
 import datetime
+from heapq import heappop, heappush
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 import re
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from common import iter_builds, slim_build
+from layercache import LayerCache
+from pulpclient import PulpClient
+import rebuild
+
+
+ANNOTATIONS = ['base-image-name', 'repositories', 'image-id', 'tar_metadata']
+
+# What rebuilding an image involves: the builds depending on it, by their
+# first tag, and their total duration and sizes
+Impact = namedtuple('Impact', ['builds', 'duration', 'upload_size', 'layer_size'])
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -18,44 +37,253 @@ def sizeof_fmt(num, suffix='B'):
 
 
 class BuildTree(object):
-    def __init__(self, builds, pulp_base_url):
+    def __init__(self, builds, pulp_base_url, jobs=8, layer_cache=None,
+                 state=None, pulp=None):
         self.deps = defaultdict(set)
         self.seen = set()
         self.when = {}
         self.known_pulp_layers = {}
         self.found_image_name_sizes = {}
         self.pulp_upload_size = {}
+        # Size of each layer including all its parents
+        self.chain_size = {}
+        # Layers in each pulp repo by image name
+        self.repo_index = {}
         self.duration = {}
         self.upload_size = {}
         self.layer_size = {}
         self.excess_repos = []
         self.pulp_base_url = pulp_base_url
+        # Builds, and layers of a repo listing, fetched ahead of use
+        self.prefetch_depth = jobs
+        if pulp is None and pulp_base_url:
+            pulp = PulpClient(jobs)
+        self.pulp = pulp
+        # Optional LayerCache which outlives this run
+        self.layer_cache = layer_cache
         # A dict to store the reference to the actual upload_size for each uploaded tag
         self.tags_aliases = {}
-        builds = [build for build in builds
+        # Latest completionTimestamp added, and the names of builds
+        # completed then
+        self.latest = None
+        self.latest_names = []
+        # Tags from a snapshot, which newer builds take over
+        self.replaceable = set()
+        self.base_of = {}
+        self.aliases_of = defaultdict(set)
+        # Builds depending directly on each build, and totals over all
+        # builds depending on it, worked out when first needed
+        self.dependents = None
+        self.dependents_totals = None
+        if state is not None:
+            self._set_state(state)
+
+        builds = [slim_build(build, ANNOTATIONS) for build in builds
                   if ('status' in build and
                       build['status'].get('phase') == 'Complete' and
-                      'startTimestamp' in build['status'])]
+                      'startTimestamp' in build['status'] and
+                      self._is_new(build))]
         builds.sort(key=lambda x: x['status']['startTimestamp'],
                     reverse=True)
-        for build in builds:
+        # Builds are only listed as Complete once they have finished, so
+        # later runs look for builds completed since this one
+        completed = [build['status']['completionTimestamp'] for build in builds
+                     if 'completionTimestamp' in build['status']]
+        if completed:
+            latest = max(completed)
+            names = [build['metadata']['name'] for build in builds
+                     if build['status'].get('completionTimestamp') == latest]
+            if latest == self.latest:
+                names.extend(self.latest_names)
+            self.latest = latest
+            self.latest_names = names
+
+        # Prefetch a few builds ahead, so what earlier builds found out
+        # stops the prefetching where add() would stop looking
+        for index, build in enumerate(builds):
+            if self.pulp:
+                if index == 0:
+                    for ahead in builds[:self.prefetch_depth]:
+                        self._prefetch(ahead)
+                elif index + self.prefetch_depth - 1 < len(builds):
+                    self._prefetch(builds[index + self.prefetch_depth - 1])
+
             self.add(build)
 
+        if self.pulp:
+            self.pulp.close()
+
+    def _is_new(self, build):
+        if self.latest is None:
+            return True
+
+        when = build['status'].get('completionTimestamp')
+        if when is None:
+            return True
+
+        # Builds completed in the same second as the latest one may not
+        # all have been listed last time
+        return (when > self.latest or
+                (when == self.latest and
+                 build['metadata'].get('name') not in self.latest_names))
+
+    def get_state(self):
+        """
+        Snapshot of the tree before trimming, as a JSON-serialisable dict
+        """
+        return {
+            'deps': dict((base, sorted(layers))
+                         for base, layers in self.deps.items()),
+            'seen': sorted(self.seen),
+            'when': self.when,
+            'duration': self.duration,
+            'upload_size': self.upload_size,
+            'layer_size': self.layer_size,
+            'tags_aliases': self.tags_aliases,
+            'latest': self.latest,
+            'latest names': self.latest_names,
+        }
+
+    def _set_state(self, state):
+        for base, layers in state['deps'].items():
+            self.deps[base] = set(layers)
+        self.seen = set(state['seen'])
+        self.when = state['when']
+        self.duration = state['duration']
+        self.upload_size = state['upload_size']
+        self.layer_size = state['layer_size']
+        self.tags_aliases = state['tags_aliases']
+        self.latest = state['latest']
+        self.latest_names = state['latest names']
+
+        # Tags newer builds may take over, and where each one is
+        self.replaceable = set(self.seen)
+        self.base_of = {}
+        for base, layers in self.deps.items():
+            for layer in layers:
+                self.base_of[layer] = base
+        self.aliases_of = defaultdict(set)
+        for tag, first_tag in self.tags_aliases.items():
+            self.aliases_of[first_tag].add(tag)
+
+    def _release_tag(self, tag):
+        """
+        Remove a snapshot tag so a newer build can take it, as it would
+        have if both builds were added in one run
+        """
+        self.replaceable.discard(tag)
+        self.seen.discard(tag)
+        self.when.pop(tag, None)
+        base = self.base_of.pop(tag, None)
+        if base is not None:
+            self.deps[base].discard(tag)
+
+        first_tag = self.tags_aliases.pop(tag, None)
+        if first_tag is None:
+            return
+
+        aliases = self.aliases_of[first_tag]
+        aliases.discard(tag)
+        if tag != first_tag:
+            return
+
+        # The old build's sizes and duration go with one of its other tags
+        del self.aliases_of[first_tag]
+        upload_size = self.upload_size.pop(tag, None)
+        layer_size = self.layer_size.pop(tag, None)
+        duration = self.duration.pop(tag, None)
+        if aliases:
+            first_tag = sorted(aliases)[0]
+            self.upload_size[first_tag] = upload_size
+            self.layer_size[first_tag] = layer_size
+            self.duration[first_tag] = duration
+            for alias in aliases:
+                self.tags_aliases[alias] = first_tag
+            self.aliases_of[first_tag] = aliases
+
+    def _pulp_repo_url(self, image_name):
+        return '%s/pulp/docker/v1/redhat-%s' % (self.pulp_base_url,
+                                                image_name.split(':')[0])
+
+    def _prefetch(self, build):
+        """
+        Start fetching the build's layer JSON and then, as each arrives,
+        its parent's, so add() finds most of them already fetched
+        """
+        try:
+            annotations = build['metadata']['annotations']
+            image_id = annotations['image-id']
+            repos_json = json.loads(annotations['repositories'])
+            image_name = '-'.join(strip_registry_from_image(
+                repos_json['unique'][0]).split('/'))
+        except (KeyError, IndexError, ValueError):
+            return
+
+        if image_id in self.pulp_upload_size:
+            return
+
+        self._prefetch_layer(self._pulp_repo_url(image_name), image_id)
+
+    def _prefetch_layer(self, pulp_repo_url, layer_id, parents_repo_url=None):
+        if layer_id in self.known_pulp_layers or layer_id in self.chain_size:
+            # Looking up sizes stops here
+            return
+
+        cached = None
+        if self.layer_cache is not None:
+            cached = self.layer_cache.get(layer_id)
+        if cached is not None:
+            # Already known, but its ancestors may not be
+            parent_id, size, image_name = cached
+            if parent_id:
+                repo_url = parents_repo_url
+                if repo_url is None:
+                    repo_url = self._pulp_repo_url(
+                        '-'.join(image_name.split(':')[0].split('/')))
+
+                self._prefetch_layer(repo_url, parent_id, repo_url)
+
+            return
+
+        def prefetch_parent(response):
+            layer_json = response.json()
+            parent_id = layer_json.get('parent')
+            if not parent_id:
+                return
+
+            repo_url = parents_repo_url
+            if repo_url is None:
+                # As in _get_size_with_parent_layers, parents are looked
+                # up in the repo named by the image's labels
+                name = layer_json['config']['Labels']['Name']
+                repo_url = self._pulp_repo_url('-'.join(name.split('/')))
+
+            self._prefetch_layer(repo_url, parent_id, repo_url)
+
+        self.pulp.submit('%s/%s/json' % (pulp_repo_url, layer_id),
+                         callback=prefetch_parent)
+
     def _get_layer_info(self, layer_id, pulp_repo_url):
+        if layer_id in self.known_pulp_layers.keys():
+            image_name = self.known_pulp_layers[layer_id]
+            size = self.found_image_name_sizes[image_name]
+            return (None, size, image_name)
+
+        return self._fetch_layer_info(layer_id, pulp_repo_url)
+
+    def _fetch_layer_info(self, layer_id, pulp_repo_url):
         layer_json = {}
         try:
             size = None
             image_name = None
             parent_id = None
-            if layer_id in self.known_pulp_layers.keys():
-                image_name = self.known_pulp_layers[layer_id]
-                size = self.found_image_name_sizes[image_name]
-                return (None, size, image_name)
-            else:
-                pulp_url = pulp_repo_url + '/%s/json' % layer_id
-                r = requests.get(pulp_url, verify=False)
-                r.raise_for_status()
-                layer_json = r.json()
+            if self.layer_cache is not None:
+                cached = self.layer_cache.get(layer_id)
+                if cached is not None:
+                    return cached
+
+            pulp_url = pulp_repo_url + '/%s/json' % layer_id
+            layer_json = self.pulp.get(pulp_url).json()
         except Exception as e:
             sys.stderr.write("  _get_layer_info(%s): %s" % (layer_id, repr(e)))
             return (None, None, None)
@@ -65,25 +293,82 @@ class BuildTree(object):
             parent_id = layer_json.get('parent', None)
             labels = layer_json['config'].get('Labels', {'Name': '', 'Version': '', 'Release': ''})
             image_name = '%s:%s-%s' % (labels['Name'], labels['Version'], labels['Release'])
+            if self.layer_cache is not None:
+                self.layer_cache.put(layer_id, parent_id, size, image_name)
         except Exception as e:
             sys.stderr.write("  _get_layer_info(%s): %s" % (layer_id, repr(e)))
 
         return (parent_id, size, image_name)
 
     def _get_size_with_parent_layers(self, image_name, parent_layer):
-        parent_layer_size = 0
-        while parent_layer:
+        # Walk up to the first layer with a known total, then fill in
+        # the totals on the way back down
+        chain = []
+        while parent_layer and parent_layer not in self.chain_size:
             parent_image_name = self.known_pulp_layers.get(parent_layer, None)
             if not parent_image_name:
                 # Lookup parent layer image in current repo
                 parent_image_name = '-'.join(image_name.split(':')[0].split('/'))
-            pulp_repo_url = '%s/pulp/docker/v1/redhat-%s' % (
-                self.pulp_base_url, parent_image_name)
-            (parent_layer, current_parent_layer_size, _) = self._get_layer_info(
+            pulp_repo_url = self._pulp_repo_url(parent_image_name)
+            (next_layer, current_parent_layer_size, _) = self._get_layer_info(
                 parent_layer, pulp_repo_url)
-            parent_layer_size += current_parent_layer_size
+            chain.append((parent_layer, current_parent_layer_size))
+            parent_layer = next_layer
+
+        parent_layer_size = self.chain_size.get(parent_layer, 0)
+        for layer, layer_size in reversed(chain):
+            parent_layer_size += layer_size
+            self.chain_size[layer] = parent_layer_size
         return parent_layer_size
 
+    def _submit_layer(self, pulp_repo_url, layer_id):
+        if (layer_id not in self.known_pulp_layers and
+                (self.layer_cache is None or
+                 self.layer_cache.get(layer_id) is None)):
+            self.pulp.submit('%s/%s/json' % (pulp_repo_url, layer_id))
+
+    def _find_in_repo(self, pulp_repo_url, image_name):
+        """
+        The layer IDs listed in a pulp repo, the (parent_id, size,
+        image_name) of each one looked at so far, and the position of
+        the first with image_name (None if there is none)
+
+        Layers are looked at in listing order, fetching a few ahead,
+        only until image_name is found, and once per run.
+        """
+        try:
+            (layer_ids, layers, positions) = self.repo_index[pulp_repo_url]
+        except KeyError:
+            r = self.pulp.get(pulp_repo_url)
+            # Skip the header link
+            layer_ids = re.findall(r'href="(.+)/"', r.text)[1:]
+            sys.stderr.write("   found %s layers\n" % len(layer_ids))
+            (layers, positions) = ([], {})
+            self.repo_index[pulp_repo_url] = (layer_ids, layers, positions)
+
+        position = len(layers)
+        if image_name not in positions:
+            for layer_id in layer_ids[position:position + self.prefetch_depth]:
+                self._submit_layer(pulp_repo_url, layer_id)
+
+        while image_name not in positions and position < len(layer_ids):
+            if position + self.prefetch_depth < len(layer_ids):
+                self._submit_layer(pulp_repo_url,
+                                   layer_ids[position + self.prefetch_depth])
+
+            layer_id = layer_ids[position]
+            if layer_id in self.known_pulp_layers:
+                # Nothing more is needed from it
+                layer = (None, None, self.known_pulp_layers[layer_id])
+            else:
+                layer = self._fetch_layer_info(layer_id, pulp_repo_url)
+
+            layers.append(layer)
+            positions.setdefault(layer[2], position)
+            position += 1
+
+        return (layer_ids, layers, positions.get(image_name))
+
     def _get_upload_size(self, build):
         annotations = build['metadata']['annotations']
         image_id = annotations['image-id']
@@ -114,7 +399,7 @@ class BuildTree(object):
             except:
                 return (0, 0)
 
-        pulp_repo_url = '%s/pulp/docker/v1/redhat-%s' % (self.pulp_base_url, image_name.split(':')[0])
+        pulp_repo_url = self._pulp_repo_url(image_name)
 
         if image_id in self.known_pulp_layers.keys():
             size = self.found_image_name_sizes[expected_image_name]
@@ -127,9 +412,13 @@ class BuildTree(object):
         pulp_url = '%s/%s/json' % (pulp_repo_url, image_id)
         sys.stderr.write("Looking for image size at %s\n" % pulp_url)
         try:
-            r = requests.get(pulp_url, verify=False)
-            r.raise_for_status()
-            size = r.json()['Size']
+            cached = None
+            if self.layer_cache is not None:
+                cached = self.layer_cache.get(image_id)
+            if cached is not None:
+                size = cached[1]
+            else:
+                size = self.pulp.get(pulp_url).json()['Size']
             self.pulp_upload_size[image_id] = size
             (parent_layer, layer_size, image_name) = self._get_layer_info(image_id, pulp_repo_url)
             total_size = self._get_size_with_parent_layers(image_name, parent_layer)
@@ -138,28 +427,42 @@ class BuildTree(object):
             try:
                 sys.stderr.write("   looking for layers at %s with image_name %s\n" % (
                     pulp_repo_url, expected_image_name))
-                # Wrong image_id, go to repo's page and check every layer id
-                r = requests.get(pulp_repo_url, verify=False)
-                matches = re.findall(r'href="(.+)/"', r.text)
-                sys.stderr.write("   found %s layers\n" % len(matches))
-                # Skip the header link
-                for layer_id in matches[1:]:
-                    (parent_layer, layer_size, image_name) = self._get_layer_info(
-                        layer_id, pulp_repo_url)
+                # Wrong image_id, find the layer by image name instead
+                (layer_ids, layers, position) = self._find_in_repo(
+                    pulp_repo_url, expected_image_name)
+                if position is None:
+                    scanned = len(layer_ids)
+                else:
+                    scanned = position + 1
+
+                # Layers listed up to the match become known, as they did
+                # when each request looked through the listing itself
+                for layer_id, layer in zip(layer_ids[:scanned], layers):
+                    if layer_id in self.known_pulp_layers:
+                        image_name = self.known_pulp_layers[layer_id]
+                        (parent_layer, layer_size) = (None, self.found_image_name_sizes[image_name])
+                    else:
+                        (parent_layer, layer_size, image_name) = layer
+
+                    if (layer_id not in self.known_pulp_layers or
+                            image_name not in self.found_image_name_sizes or
+                            self.found_image_name_sizes[image_name] != layer_size):
+                        # _get_layer_info ends the chain at known layers,
+                        # so totals walked through this one may change
+                        self.chain_size.clear()
 
                     self.found_image_name_sizes[image_name] = layer_size
                     self.known_pulp_layers[layer_id] = image_name
-                    if image_name != expected_image_name:
-                        sys.stderr.write("   %s != %s\n" % (image_name, expected_image_name))
-                        continue
-                    sys.stderr.write("  found layer with size %s\n" % layer_size)
-                    parent_layer_size = self._get_size_with_parent_layers(image_name, parent_layer)
-                    sys.stderr.write("  parent's layer size: %s\n" % parent_layer_size)
-                    total_size = layer_size + parent_layer_size
-                    self.pulp_upload_size[image_id] = total_size
-                    return (total_size, layer_size)
-                else:
+
+                if position is None:
                     raise RuntimeError("No matching layer found")
+
+                sys.stderr.write("  found layer with size %s\n" % layer_size)
+                parent_layer_size = self._get_size_with_parent_layers(image_name, parent_layer)
+                sys.stderr.write("  parent's layer size: %s\n" % parent_layer_size)
+                total_size = layer_size + parent_layer_size
+                self.pulp_upload_size[image_id] = total_size
+                return (total_size, layer_size)
             except Exception as e:
                 sys.stderr.write("    cannot find layer info at this url: %s\n" % (repr(e)))
                 self.pulp_upload_size[image_id] = 0
@@ -178,6 +481,13 @@ class BuildTree(object):
 
         repos = set([strip_registry_from_image(repo)
                      for repo in repositories['primary']])
+        self.dependents = None
+        for repo in repos.intersection(self.replaceable):
+            # Builds are added newest first, but one which was still
+            # running at the last run may have started before the
+            # snapshot build pushing the same tag
+            if self.when.get(repo, when) <= when:
+                self._release_tag(repo)
         duplicates = self.seen.intersection(repos)
         repos -= duplicates
         self.seen.update(repos)
@@ -192,35 +502,66 @@ class BuildTree(object):
                 self.when[repo] = when
                 self.tags_aliases[repo] = first_tag
 
-    def _trim_layers(self, base):
-        layers = self.deps[base]
-        excess = set()
-        for layer in layers:
-            name, version = layer.split(':', 1)
-            if version == 'latest':
-                pass
-            elif not self.deps.get(layer):
-                # Leaf node
-                excess.add(layer)
-
-        self.deps[base] -= excess
-        self.excess_repos += excess
-        return excess
+    @staticmethod
+    def _is_latest(tag):
+        name, version = tag.split(':', 1)
+        return version == 'latest'
 
     def trim_excess_tags(self):
-        while True:
-            images = [image for image in self.deps.keys()]
-            any_trimmed = False
-            for base in images:
-                if self.deps.get(base):
-                    if self._trim_layers(base):
-                        any_trimmed = True
-
-            if not any_trimmed:
-                break
+        """
+        Remove tags other than 'latest' which nothing is built on,
+        repeating until there are none left
+
+        Each base is revisited only when one of its layers becomes
+        trimmable, in the order repeated passes over deps trimmed them.
+        """
+        self.dependents = None
+        images = list(self.deps.keys())
+        position = dict((base, index) for index, base in enumerate(images))
+        parent = {}
+        remaining = {}
+        for base in images:
+            remaining[base] = len(self.deps[base])
+            for layer in self.deps[base]:
+                parent[layer] = base
+
+        # (pass, position) of each base due to be trimmed, and the
+        # layers it will lose then
+        queue = []
+        trimmable = defaultdict(list)
+
+        def schedule(layer, now):
+            base = parent.get(layer)
+            if base is None:
+                return
+
+            if not trimmable[base]:
+                if position[base] > now[1]:
+                    heappush(queue, (now[0], position[base]))
+                else:
+                    heappush(queue, (now[0] + 1, position[base]))
+
+            trimmable[base].append(layer)
+
+        for layer in parent:
+            if not self._is_latest(layer) and not remaining.get(layer):
+                schedule(layer, (0, -1))
+
+        while queue:
+            now = heappop(queue)
+            base = images[now[1]]
+            # Trimming reorders the set, so go through it as it is now
+            layers = set(trimmable.pop(base))
+            excess = set(layer for layer in self.deps[base] if layer in layers)
+            self.deps[base] -= excess
+            self.excess_repos += excess
+            remaining[base] -= len(excess)
+            if (not remaining[base] and base in parent and
+                    not self._is_latest(base)):
+                schedule(base, now)
 
     def get_trimmed_layer_size(self):
-        trimmed_layers = []
+        trimmed_layers = set()
         images = [image for image in self.deps.keys()]
         for base in images:
             layers = self.deps.get(base, [])
@@ -229,10 +570,89 @@ class BuildTree(object):
                     continue
                 if self.layer_size.get(base) and self.layer_size.get(layer):
                     self.layer_size[layer] -= self.layer_size[base]
-                trimmed_layers.append(layer)
+                trimmed_layers.add(layer)
 
         return sum([v for k, v in self.layer_size.items()])
 
+    def _index_dependents(self):
+        """
+        Map each build, by its first tag, to the builds using any of its
+        tags as their base, and sum the duration and sizes over all the
+        builds depending on each one
+        """
+        dependents = defaultdict(set)
+        for base, layers in self.deps.items():
+            node = self.tags_aliases.get(base, base)
+            for layer in layers:
+                dependent = self.tags_aliases.get(layer, layer)
+                if dependent != node:
+                    dependents[node].add(dependent)
+
+        # Each build has a single base, so the builds depending on one
+        # form a tree and their totals can be added up from the leaves
+        totals = {}
+        visiting = set()
+        for root in list(dependents.keys()):
+            stack = [root]
+            while stack:
+                node = stack[-1]
+                if node in totals:
+                    stack.pop()
+                    continue
+
+                if node not in visiting:
+                    visiting.add(node)
+                    stack.extend(dependent for dependent in dependents.get(node, ())
+                                 if dependent not in visiting)
+                    continue
+
+                stack.pop()
+                count, duration, upload_size, layer_size = 0, 0, 0, 0
+                for dependent in dependents.get(node, ()):
+                    # Nothing is below a build seen again through a cycle
+                    below = totals.get(dependent, (0, 0, 0, 0))
+                    count += 1 + below[0]
+                    duration += self.duration.get(dependent, 0) + below[1]
+                    upload_size += self.upload_size.get(dependent, 0) + below[2]
+                    layer_size += self.layer_size.get(dependent, 0) + below[3]
+
+                totals[node] = (count, duration, upload_size, layer_size)
+
+        self.dependents = dependents
+        self.dependents_totals = totals
+
+    def get_dependents(self):
+        """
+        Map each build, by its first tag, to the builds based on it
+        """
+        if self.dependents is None:
+            self._index_dependents()
+
+        return self.dependents
+
+    def get_impact(self, image):
+        """
+        Impact of rebuilding image, a tag of a build in the tree or a
+        base image: every build depending on it, directly or not
+        """
+        if self.dependents is None:
+            self._index_dependents()
+
+        tag = strip_registry_from_image(image)
+        node = self.tags_aliases.get(tag, tag)
+        (count, duration, upload_size, layer_size) = self.dependents_totals.get(
+            node, (0, 0, 0, 0))
+        builds = []
+        seen = set([node])
+        stack = [node]
+        while stack:
+            dependents = sorted(self.dependents.get(stack.pop(), set()) - seen)
+            seen.update(dependents)
+            builds.extend(dependents)
+            stack.extend(dependents)
+
+        return Impact(builds, duration, upload_size, layer_size)
+
     def calculate_totals(self):
         trimmed_duration = sum([v for k, v in self.duration.items()])
         trimmed_upload_size = sum([v for k, v in self.upload_size.items()])
@@ -269,60 +689,196 @@ class BuildTree(object):
             else:
                 return ""
 
-    def as_graph_easy_txt(self,
-                          include_datestamp=False,
-                          include_duration=False,
-                          include_upload=False):
-        txt = ''
-
-        def formatwhen(name):
-            if include_datestamp:
-                try:
-                    return "\\n{when}".format(when=self.when[name][:10])
-                except KeyError:
-                    return ""
-            else:
-                return ""
+    def _get_tag_values(self, tag_name):
+        if tag_name not in self.duration.keys():
+            tag_name = self.tags_aliases.get(tag_name, tag_name)
+        return (self.duration.get(tag_name),
+                self.upload_size.get(tag_name),
+                self.layer_size.get(tag_name))
+
+    def _get_labeller(self, format_label,
+                      include_datestamp=False,
+                      include_duration=False,
+                      include_upload=False):
+        """
+        Function returning format_label() of each tag's label lines,
+        worked out once per tag
+        """
+        labels = {}
+
+        def label(name):
+            try:
+                return labels[name]
+            except KeyError:
+                pass
 
-        def formatduration(name):
+            lines = [name]
+            if include_datestamp and name in self.when:
+                lines.append(self.when[name][:10])
             if include_duration:
-                return "\\n{duration}".format(duration=self.get_build_duration(name))
-            else:
-                return ""
-
-        def formatupload(name):
+                lines.append(self.get_build_duration(name))
             if include_upload:
-                return "\\n{upload}".format(upload=self.get_upload_size(name))
-            else:
-                return ""
+                lines.append(self.get_upload_size(name))
+
+            labels[name] = format_label(lines)
+            return labels[name]
 
+        return label
+
+    def write_graph_easy(self, fp,
+                         include_datestamp=False,
+                         include_duration=False,
+                         include_upload=False):
+        label = self._get_labeller(lambda lines: "[ %s ]" % "\\n".join(lines),
+                                   include_datestamp, include_duration,
+                                   include_upload)
         for base, layers in self.deps.items():
             for layer in layers:
-                txt += "[ {base}{when}{duration}{upload} ]".format(base=base,
-                                                                   when=formatwhen(base),
-                                                                   duration=formatduration(base),
-                                                                   upload=formatupload(base))
-                txt += " --> "
-                txt += "[ {layer}{when}{duration}{upload} ]".format(layer=layer,
-                                                                    when=formatwhen(layer),
-                                                                    duration=formatduration(layer),
-                                                                    upload=formatupload(layer))
-                txt += "\n"
-
-        return txt
-
-
-def run(inputfile=None, pulp_base_url=None):
-    if inputfile is not None:
-        with open(inputfile) as fp:
-            builds = json.load(fp)
-    else:
-        builds = json.load(sys.stdin)
+                fp.write("%s --> %s\n" % (label(base), label(layer)))
+
+    def write_dot(self, fp,
+                  include_datestamp=False,
+                  include_duration=False,
+                  include_upload=False):
+        """
+        Write the graph in Graphviz DOT format, for dot without graph-easy
+        """
+        def quote(text):
+            return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+        def node(lines):
+            return '    %s [label="%s"];\n' % (
+                quote(lines[0]), "\\n".join(quote(line)[1:-1] for line in lines))
+
+        label = self._get_labeller(node, include_datestamp, include_duration,
+                                   include_upload)
+        declared = set()
+        fp.write("digraph builds {\n")
+        for base, layers in self.deps.items():
+            for layer in layers:
+                for name in (base, layer):
+                    if name not in declared:
+                        declared.add(name)
+                        fp.write(label(name))
+
+                fp.write("    %s -> %s;\n" % (quote(base), quote(layer)))
+
+        fp.write("}\n")
+
+    def write_json(self, fp):
+        """
+        Write the graph as a JSON object with a list of nodes, each with
+        its start time, duration in seconds and sizes in bytes, and a
+        list of [base, layer] edges
+        """
+        fp.write('{"nodes": [')
+        declared = set()
+        for base, layers in self.deps.items():
+            for layer in layers:
+                for name in (base, layer):
+                    if name in declared:
+                        continue
+
+                    (duration, upload_size, layer_size) = self._get_tag_values(name)
+                    node = {
+                        'name': name,
+                        'when': self.when.get(name),
+                        'duration': duration,
+                        'upload_size': upload_size,
+                        'layer_size': layer_size,
+                    }
+                    fp.write('\n  ' if not declared else ',\n  ')
+                    fp.write(json.dumps(node, sort_keys=True))
+                    declared.add(name)
+
+        fp.write('\n], "edges": [')
+        first = True
+        for base, layers in self.deps.items():
+            for layer in layers:
+                fp.write('\n  ' if first else ',\n  ')
+                fp.write(json.dumps([base, layer]))
+                first = False
+
+        fp.write('\n]}\n')
 
-    tree = BuildTree(builds, pulp_base_url)
+    def as_graph_easy_txt(self,
+                          include_datestamp=False,
+                          include_duration=False,
+                          include_upload=False):
+        txt = StringIO()
+        self.write_graph_easy(txt, include_datestamp, include_duration,
+                              include_upload)
+        return txt.getvalue()
+
+
+def load_tree(inputfile=None, pulp_base_url=None, jobs=8,
+              layer_cache_path=None, layer_cache_size=None, snapshot=None,
+              pulp_record=None):
+    layer_cache = None
+    if layer_cache_path is not None:
+        # A recording has to hold every response, not just the layers
+        # the cache did not know
+        layer_cache = LayerCache(layer_cache_path, layer_cache_size,
+                                 refresh=pulp_record is not None)
+
+    pulp = None
+    if pulp_base_url:
+        pulp = PulpClient(jobs, record=pulp_record is not None)
+
+    state = None
+    if snapshot is not None and os.path.exists(snapshot):
+        with open(snapshot) as fp:
+            state = json.load(fp)
+
+    try:
+        if inputfile is not None:
+            with open(inputfile) as fp:
+                tree = BuildTree(iter_builds(fp), pulp_base_url, jobs,
+                                 layer_cache, state, pulp)
+        else:
+            tree = BuildTree(iter_builds(sys.stdin), pulp_base_url, jobs,
+                             layer_cache, state, pulp)
+    finally:
+        if layer_cache is not None:
+            layer_cache.close()
+
+    if pulp is not None:
+        stats = pulp.get_stats()
+        sys.stderr.write("Pulp requests: %s (%s shared, %s errors), %s fetched\n" % (
+            stats['requests'], stats['shared'], stats['errors'],
+            sizeof_fmt(stats['bytes'])))
+        sys.stderr.write("Pulp latency: %s\n" % ', '.join(
+            "%s%s" % ("<%ss: " % bound if bound is not None else "more: ", count)
+            for bound, count in stats['latency'] if count))
+        if layer_cache is not None:
+            sys.stderr.write("Layer cache: %s hits, %s misses\n" % (
+                layer_cache.hits, layer_cache.misses))
+        if pulp_record is not None:
+            pulp.save_recording(pulp_record)
+
+    if snapshot is not None:
+        # Trimming is repeated on each run, so keep the untrimmed tree
+        with open(snapshot, 'w') as fp:
+            json.dump(tree.get_state(), fp, separators=(',', ':'))
+
+    return tree
+
+
+def run(inputfile=None, pulp_base_url=None, jobs=8,
+        layer_cache_path=None, layer_cache_size=None,
+        output_format='graph-easy', snapshot=None, pulp_record=None):
+    tree = load_tree(inputfile, pulp_base_url, jobs, layer_cache_path,
+                     layer_cache_size, snapshot, pulp_record)
     tree.trim_excess_tags()
-    print(tree.as_graph_easy_txt(
-          include_datestamp=True, include_duration=True, include_upload=True))
+    if output_format == 'json':
+        tree.write_json(sys.stdout)
+    elif output_format == 'dot':
+        tree.write_dot(sys.stdout, include_datestamp=True,
+                       include_duration=True, include_upload=True)
+    else:
+        tree.write_graph_easy(sys.stdout, include_datestamp=True,
+                              include_duration=True, include_upload=True)
+        sys.stdout.write("\n")
 
     (total_duration, total_upload_size, total_layers_size) = tree.calculate_totals()
 
@@ -332,7 +888,117 @@ def run(inputfile=None, pulp_base_url=None):
         sizeof_fmt(total_layers_size),
         sizeof_fmt(total_upload_size)))
 
+
+def run_impact(image, inputfile=None, pulp_base_url=None, jobs=8,
+               layer_cache_path=None, layer_cache_size=None, snapshot=None,
+               pulp_record=None):
+    tree = load_tree(inputfile, pulp_base_url, jobs, layer_cache_path,
+                     layer_cache_size, snapshot, pulp_record)
+    # Leave out old releases nothing is built on, which a rebuild would
+    # not repeat
+    tree.trim_excess_tags()
+    impact = tree.get_impact(image)
+    for build in impact.builds:
+        print("%s %s %s" % (build, tree.get_build_duration(build),
+                            tree.get_upload_size(build)))
+
+    print("Rebuilding %s rebuilds %s images" % (image, len(impact.builds)))
+    print("Total duration: %s" % str(datetime.timedelta(seconds=impact.duration)))
+    print("Total upload size: %s (%s to Pulp and %s to Brew/Koji)" % (
+        sizeof_fmt(impact.upload_size + impact.layer_size),
+        sizeof_fmt(impact.layer_size),
+        sizeof_fmt(impact.upload_size)))
+
+
+def run_schedule(image=None, slots=None, inputfile=None, pulp_base_url=None,
+                 jobs=8, layer_cache_path=None, layer_cache_size=None,
+                 snapshot=None, pulp_record=None):
+    tree = load_tree(inputfile, pulp_base_url, jobs, layer_cache_path,
+                     layer_cache_size, snapshot, pulp_record)
+    tree.trim_excess_tags()
+    dependents = tree.get_dependents()
+    if image is not None:
+        builds = tree.get_impact(image).builds
+    else:
+        builds = set()
+        for layers in dependents.values():
+            builds.update(layers)
+
+    total_duration = sum(tree.duration.get(build, 0) for build in builds)
+    print("Rebuilding %s images, %s in total" % (
+        len(builds), datetime.timedelta(seconds=total_duration)))
+
+    path = rebuild.critical_path(builds, dependents, tree.duration)
+    print("Critical path: %s over %s builds" % (
+        datetime.timedelta(seconds=path.duration), len(path.builds)))
+    for build in path.builds:
+        print("  %s %s" % (build, tree.get_build_duration(build)))
+
+    print("%5s %25s %12s" % ('slots', 'time', 'utilisation'))
+    for count in slots or [1, 2, 4, 8, 16, 32]:
+        (seconds, starts) = rebuild.makespan(builds, dependents, tree.duration,
+                                             count)
+        utilisation = total_duration / (count * seconds) if seconds else 0
+        print("%5s %25s %11.1f%%" % (count, datetime.timedelta(seconds=seconds),
+                                     utilisation * 100))
+
+
+def add_tree_arguments(parser):
+    parser.add_argument("--jobs", type=int, default=8,
+                        help="concurrent requests to pulp")
+    parser.add_argument("--layer-cache", metavar="FILE",
+                        help="sqlite file to keep pulp layer details in "
+                        "between runs")
+    parser.add_argument("--layer-cache-size", type=int, metavar="N",
+                        help="keep at most N layers in the layer cache")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="load the tree from FILE if it exists and only "
+                        "add builds newer than it, then save it there")
+    parser.add_argument("--pulp-record", metavar="FILE",
+                        help="save the pulp responses to FILE, for "
+                        "pulpreplay.py to serve")
+    parser.add_argument("inputfile", nargs='?', default=None)
+    parser.add_argument("pulp_base_url", nargs='?', default=None)
+
+
 if __name__ == '__main__':
-    args = [sys.argv[1] if len(sys.argv) > 1 else None,
-            sys.argv[2] if len(sys.argv) > 2 else None]
-    run(*args)
+    # Subcommands are looked for by hand, since "graph.py inputfile"
+    # has to keep working
+    if sys.argv[1:2] == ['impact']:
+        parser = argparse.ArgumentParser(
+            prog='%s impact' % sys.argv[0],
+            description="List the builds depending on an image and what "
+            "rebuilding them all costs")
+        parser.add_argument("image", help="image tag or base image")
+        add_tree_arguments(parser)
+        args = parser.parse_args(sys.argv[2:])
+        run_impact(args.image, args.inputfile, args.pulp_base_url, args.jobs,
+                   args.layer_cache, args.layer_cache_size, args.snapshot,
+                   args.pulp_record)
+    elif sys.argv[1:2] == ['schedule']:
+        parser = argparse.ArgumentParser(
+            prog='%s schedule' % sys.argv[0],
+            description="Estimate how long rebuilding images takes with "
+            "a number of builds running at once")
+        parser.add_argument("--image",
+                            help="only rebuild images depending on this one")
+        parser.add_argument("--slots", type=int, action='append',
+                            help="builds running at once, may be repeated "
+                            "(default 1, 2, 4, ... 32)")
+        add_tree_arguments(parser)
+        args = parser.parse_args(sys.argv[2:])
+        if args.slots and min(args.slots) < 1:
+            parser.error("--slots must be at least 1")
+        run_schedule(args.image, args.slots, args.inputfile,
+                     args.pulp_base_url, args.jobs, args.layer_cache,
+                     args.layer_cache_size, args.snapshot, args.pulp_record)
+    else:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--format", choices=['graph-easy', 'dot', 'json'],
+                            default='graph-easy',
+                            help="output format (default graph-easy)")
+        add_tree_arguments(parser)
+        args = parser.parse_args()
+        run(args.inputfile, args.pulp_base_url, args.jobs, args.layer_cache,
+            args.layer_cache_size, args.format, args.snapshot,
+            args.pulp_record)
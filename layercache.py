@@ -0,0 +1,87 @@
+"""
+Persistent cache of Pulp layer metadata.
+
+Layer JSON never changes for a given layer ID, so the size, parent and
+label-derived image name found for a layer can be kept between runs.
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class LayerCache(object):
+    """
+    sqlite store of (parent, size, image_name) keyed by layer ID
+
+    With max_entries set, the least recently used layers beyond that
+    many are evicted on close(). With refresh set, layers are only
+    stored, never looked up, so every layer is fetched again.
+    """
+
+    # Commit after this many new layers
+    COMMIT_EVERY = 100
+
+    def __init__(self, path, max_entries=None, refresh=False):
+        self.max_entries = max_entries
+        self.refresh = refresh
+        # Prefetching threads look layers up too
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS layers ('
+                        'layer_id TEXT PRIMARY KEY, '
+                        'parent TEXT, '
+                        'size INTEGER, '
+                        'image_name TEXT, '
+                        'last_used INTEGER)')
+        self.touched = set()
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, layer_id):
+        """
+        (parent, size, image_name) for layer_id, or None if unknown
+        """
+        if self.refresh:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            row = self.db.execute('SELECT parent, size, image_name FROM layers '
+                                  'WHERE layer_id = ?', (layer_id,)).fetchone()
+            if row is not None:
+                self.touched.add(layer_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return row
+
+    def put(self, layer_id, parent, size, image_name):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO layers VALUES (?, ?, ?, ?, ?)',
+                            (layer_id, parent, size, image_name, int(time.time())))
+            self.uncommitted += 1
+            if self.uncommitted >= self.COMMIT_EVERY:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM layers').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            now = int(time.time())
+            self.db.executemany('UPDATE layers SET last_used = ? WHERE layer_id = ?',
+                                [(now, layer_id) for layer_id in self.touched])
+            if self.max_entries is not None:
+                self.db.execute('DELETE FROM layers WHERE layer_id NOT IN ('
+                                'SELECT layer_id FROM layers '
+                                'ORDER BY last_used DESC LIMIT ?)',
+                                (self.max_entries,))
+
+            self.db.commit()
+            self.db.close()
@@ -1,19 +1,39 @@
-from calendar import timegm
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
 import json
 import os
 import re
 import subprocess
 import sys
 import argparse
-from time import ctime, gmtime, strftime, strptime
+from operator import attrgetter
+from heapq import heappop, heappush
+from itertools import islice
+import multiprocessing
+from time import ctime, gmtime, strftime
+
+from common import (TIME_FORMAT, columnar_parts, iter_builds, rfc3339_time,
+                    slim_build)
+from tdigest import TDigest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 FIELDS = [('name', 'name'),
           ('image', 'image'),
           ('completion', 'completion'),
           ('state', 'state'),
+          ('throughput_15m', 'throughput_15m'),
           ('throughput', 'throughput'),
+          ('throughput_24h', 'throughput_24h'),
           ('pending', 'pending'),
           ('running', 'running'),
           ('pull_base_image', 'plugin_pull_base_image'),
@@ -26,67 +46,424 @@ FIELDS = [('name', 'name'),
           ('failed_plugin', 'failed_plugin'),
           ('exception', 'exception')]
 Metrics = namedtuple('Metrics', [field[0] for field in FIELDS])
+# Metrics fields taken from plugins-metadata and the other annotations
+PLUGINS = ['pull_base_image',
+           'distgit_fetch_artefacts',
+           'dockerfile_content',
+           'squash',
+           'compress',
+           'pulp_push',
+           'image',
+           'failed_plugin',
+           'exception']
+
+# Annotations BuildRecord reads
+ANNOTATIONS = ['plugins-metadata', 'tar_metadata', 'repositories']
+
+CONCURRENT_COLUMNS = ['timestamp', 'nbuilds']
+
+# Type of each output column in columnar output, timestamps are held
+# as seconds since the epoch until they are written
+COLUMN_TYPES = defaultdict(lambda: 'float64', {
+    'name': 'str',
+    'image': 'str',
+    'completion': 'datetime64[s]',
+    'state': 'str',
+    'throughput_15m': 'int64',
+    'throughput': 'int64',
+    'throughput_24h': 'int64',
+    'failed_plugin': 'str',
+    'exception': 'str',
+    'timestamp': 'datetime64[s]',
+    'nbuilds': 'int64',
+})
+
+# Plugins whose durations are summarised as percentiles
+DURATION_PLUGINS = PLUGINS[:PLUGINS.index('image')]
+
+# Metrics field and window length (seconds) for each throughput count
+THROUGHPUT_WINDOWS = [('throughput_15m', 15 * 60),
+                      ('throughput', 60 * 60),
+                      ('throughput_24h', 24 * 60 * 60)]
+
+
+def write_csv(filename, columns, rows, append=False):
+    timestamps = [index for index, column in enumerate(columns)
+                  if COLUMN_TYPES[column] == 'datetime64[s]']
+    with open(filename, 'a' if append else 'w') as fp:
+        if not append:
+            fp.write(",".join(columns) + '\n')
+        for row in rows:
+            row = list(row)
+            for index in timestamps:
+                row[index] = strftime(TIME_FORMAT, gmtime(row[index]))
+            fp.write(",".join([str(m) for m in row]) + '\n')
+
+
+def _column_values(column, values):
+    if COLUMN_TYPES[column] == 'float64':
+        # 'nan' placeholders become real NaNs
+        return [float(value) for value in values]
+
+    return list(values)
+
+
+def write_columnar(filename, columns, rows, append=False):
+    """
+    Write a typed table to filename.parquet, or filename.npz when
+    pyarrow is not installed
+
+    When appending, the rows go to a new part file next to it
+    (filename.1.parquet and so on) so earlier rows are not rewritten.
+    """
+    if pyarrow is not None:
+        filename += '.parquet'
+    elif np is not None:
+        filename += '.npz'
+    else:
+        raise RuntimeError("columnar output needs pyarrow or numpy")
 
+    parts = columnar_parts(filename)
+    if append and os.path.exists(filename):
+        if not rows:
+            return
 
-def rfc3339_time(rfc3339):
-    time_tuple = strptime(rfc3339, '%Y-%m-%dT%H:%M:%SZ')
-    return timegm(time_tuple)
+        base, ext = os.path.splitext(filename)
+        filename = '{base}.{part}{ext}'.format(base=base, part=len(parts),
+                                               ext=ext)
+    else:
+        # Parts of a previous run's table
+        for part in parts[1:]:
+            os.unlink(part)
+
+    data = dict(zip(columns, zip(*rows))) if rows else {}
+    if pyarrow is not None:
+        types = {'str': pyarrow.string(),
+                 'int64': pyarrow.int64(),
+                 'float64': pyarrow.float64(),
+                 'datetime64[s]': pyarrow.int64()}
+        arrays = []
+        for column in columns:
+            array = pyarrow.array(_column_values(column, data.get(column, [])),
+                                  types[COLUMN_TYPES[column]])
+            if COLUMN_TYPES[column] == 'datetime64[s]':
+                array = array.cast(pyarrow.timestamp('s'))
+            arrays.append(array)
+
+        table = pyarrow.Table.from_arrays(arrays, names=columns)
+        pyarrow.parquet.write_table(table, filename)
+    else:
+        arrays = {column: np.array(_column_values(column, data.get(column, [])),
+                                   dtype=COLUMN_TYPES[column])
+                  for column in columns}
+        with open(filename, 'wb') as fp:
+            np.savez(fp, **arrays)
 
 
 class ThroughputModel(object):
-    def __init__(self, window):
-        self.builds = []
-        self.start_time = None  # start of window
-        self.window = window
+    def __init__(self, windows, state=None):
+        # One deque of timestamps per (name, length) window
+        state = state or {}
+        self.windows = windows
+        self.builds = [deque(state.get(name, [])) for name, window in windows]
 
     def append(self, timestamp):
-        if not self.builds:
-            self.start_time = timestamp
+        counts = {}
+        for (name, window), builds in zip(self.windows, self.builds):
+            builds.append(timestamp)
+            while timestamp - builds[0] >= window:
+                builds.popleft()
+
+            counts[name] = len(builds)
 
-        self.builds.append(timestamp)
-        while self.builds[-1] - self.builds[0] >= self.window:
-            del self.builds[0]
+        return counts
 
-        return len(self.builds)
+    def get_state(self):
+        return {name: list(builds)
+                for (name, window), builds in zip(self.windows, self.builds)}
 
 
 class ConcurrentModel(object):
-    def __init__(self):
+    def __init__(self, state=None):
+        state = state or {}
         self.start_finish = []
-        self.finish_times = []
+        # heap of running builds' finish times
+        self.finish_times = state.get('finish_times', [])
+        self.peak = state.get('peak', 0)
+        # seconds spent at each nbuilds
+        self.level_time = defaultdict(int, state.get('level_time', []))
+        # most recent (timestamp, nbuilds)
+        self.last = tuple(state['last']) if state.get('last') else None
 
     def append(self, start, finish):
         self.start_finish.append((start, finish))
 
+    def _transition(self, timestamp, nbuilds):
+        if self.last is not None:
+            last_timestamp, last_nbuilds = self.last
+            self.level_time[last_nbuilds] += timestamp - last_timestamp
+
+        self.last = (timestamp, nbuilds)
+        self.peak = max(self.peak, nbuilds)
+        return self.last
+
     def get_nbuilds(self):
         for start, finish in self.start_finish:
-            while self.finish_times:
-                if start < self.finish_times[0]:
-                    break
+            if self.last is not None and start < self.last[0]:
+                # Started before the last start of a previous
+                # incremental run, count it from there
+                start = self.last[0]
+
+            while self.finish_times and self.finish_times[0] <= start:
+                finished = heappop(self.finish_times)
+                yield self._transition(finished, len(self.finish_times))
+
+            heappush(self.finish_times, finish)
+            yield self._transition(start, len(self.finish_times))
+
+    def get_stats(self):
+        """
+        Summarise concurrency, only valid once get_nbuilds() is exhausted
+        """
+        # Builds still running after the last start are not part of the
+        # series but still count towards the time spent at each level
+        level_time = defaultdict(int, self.level_time)
+        finish_times = sorted(self.finish_times)
+        last_timestamp, last_nbuilds = self.last or (None, 0)
+        for finished in finish_times:
+            level_time[last_nbuilds] += finished - last_timestamp
+            last_timestamp = finished
+            last_nbuilds -= 1
+
+        total = sum(level_time.values())
+        weighted = sum(nbuilds * seconds
+                       for nbuilds, seconds in level_time.items())
+        return {
+            'peak': self.peak,
+            'mean': weighted / float(total) if total else 0,
+            'seconds at level': dict(level_time),
+        }
+
+    def get_state(self):
+        return {
+            'finish_times': list(self.finish_times),
+            'peak': self.peak,
+            'level_time': sorted(self.level_time.items()),
+            'last': self.last,
+        }
+
+
+class DurationSketches(object):
+    """
+    t-digests of each plugin's duration and the total running time,
+    overall and per image
+    """
+
+    QUANTILES = [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.plugins = {name: TDigest.from_dict(digest)
+                        for name, digest in state.get('plugins', {}).items()}
+        self.images = {name: TDigest.from_dict(digest)
+                       for name, digest in state.get('images', {}).items()}
+
+    def _add(self, digests, name, value):
+        if value == 'nan':
+            return
+
+        try:
+            digest = digests[name]
+        except KeyError:
+            digest = digests[name] = TDigest()
+
+        digest.add(value)
+
+    def add(self, record):
+        for plugin, value in zip(PLUGINS, record.plugins):
+            if plugin in DURATION_PLUGINS:
+                self._add(self.plugins, plugin, value)
+
+        self._add(self.plugins, 'running', record.running)
+        image = record.plugins[PLUGINS.index('image')]
+        if image not in ('nan', ''):
+            self._add(self.images, image, record.running)
 
-                yield (self.finish_times[0], len(self.finish_times) - 1)
-                del self.finish_times[0]
+    def merge(self, other):
+        for mine, theirs in [(self.plugins, other.plugins),
+                             (self.images, other.images)]:
+            for name, digest in theirs.items():
+                if name in mine:
+                    mine[name].merge(digest)
+                else:
+                    mine[name] = TDigest.from_dict(digest.to_dict())
 
-            self.finish_times.append(finish)
-            self.finish_times.sort()
-            yield (start, len(self.finish_times))
+    def get_stats(self):
+        def percentiles(digests):
+            stats = {}
+            for name, digest in digests.items():
+                stats[name] = {label: digest.quantile(quantile)
+                               for label, quantile in self.QUANTILES}
+                stats[name]['count'] = digest.count
+
+            return stats
+
+        return {
+            'plugins': percentiles(self.plugins),
+            'images': percentiles(self.images),
+        }
+
+    def get_state(self):
+        return {
+            'plugins': {name: digest.to_dict()
+                        for name, digest in self.plugins.items()},
+            'images': {name: digest.to_dict()
+                       for name, digest in self.images.items()},
+        }
 
 
 class MissingLog(Exception):
     pass
 
 
+class BuildRecord(object):
+    """
+    The parts of a completed build which get_stats needs, decoded once
+    """
+
+    __slots__ = ('name', 'state', 'start', 'completion', 'which', 'pending',
+                 'running', 'upload_size_mb', 'plugins')
+
+    def __init__(self, build):
+        metadata = build['metadata']
+        status = build['status']
+        self.name = metadata['name']
+        self.state = status['phase']
+        self.completion = rfc3339_time(status['completionTimestamp'])
+        self.start = None
+        startTimestamp = status.get('startTimestamp')
+        if startTimestamp is None:
+            return
+
+        self.start = rfc3339_time(startTimestamp)
+        self.pending = self.start - rfc3339_time(metadata['creationTimestamp'])
+        if self.pending < 0:
+            self.which = 'archived'
+            self.pending = 'nan'
+        else:
+            self.which = 'current'
+
+        self.running = status.get('duration', 0) / 1000000000
+        self.upload_size_mb = 'nan'
+        plugins = dict.fromkeys(PLUGINS, 'nan')
+        annotations = metadata.get('annotations', {})
+        try:
+            plugins_metadata = json.loads(annotations['plugins-metadata'])
+            durations = plugins_metadata['durations']
+        except Exception:
+            plugins_metadata = {}
+            durations = {}
+
+        try:
+            errors = plugins_metadata['errors']
+            first_failed = sorted(errors.keys())[0]
+            plugins['failed_plugin'] = first_failed
+            exception_text = errors[first_failed].split("(")[0]
+            # Make sure commas are escaped and double quotes are replaced
+            plugins['exception'] = json.dumps(exception_text.replace('"', "'"))
+        except (KeyError, IndexError):
+            pass
+
+        if self.state == 'Complete' and self.which == 'current':
+            tar_metadata = annotations.get('tar_metadata')
+            if tar_metadata:
+                md = json.loads(tar_metadata)
+                self.upload_size_mb = md['size'] / (1024 * 1024)
+
+            for plugin in PLUGINS:
+                if plugin in durations:
+                    plugins[plugin] = durations[plugin]
+
+            repositories = annotations.get('repositories')
+            if repositories:
+                repositories_json = json.loads(repositories)
+                try:
+                    image_name = '/'.join(repositories_json['unique'][0].split('/')[1:])
+                    plugins['image'] = image_name.split(':')[0]
+                except IndexError:
+                    plugins['image'] = ''
+
+        self.plugins = tuple(plugins[plugin] for plugin in PLUGINS)
+
+
 class Builds(object):
-    def __init__(self, builds, osbs_instance=None):
+    # Builds handed to each worker process at a time with --jobs
+    CHUNK_SIZE = 500
+
+    def __init__(self, builds, osbs_instance=None, jobs=1, output_format='csv'):
         self.osbs_instance = osbs_instance
         self.builds = builds
+        self.jobs = jobs
+        self.output_format = output_format
+
+    def get_records(self, since=None):
+        """
+        Decode builds completed at or after since into BuildRecords, in
+        input order, sharing the work between self.jobs processes
+        """
+        builds = (build for build in self.builds
+                  if 'completionTimestamp' in build.get('status', {}))
+        if since is not None:
+            builds = (build for build in builds
+                      if rfc3339_time(build['status']['completionTimestamp']) >= since)
+
+        if self.jobs <= 1:
+            return [BuildRecord(build) for build in builds]
+
+        # Hand out a batch at a time so the workers decode one batch
+        # while the next is read from the input. Only the fields
+        # BuildRecord reads are sent, pickling whole builds costs
+        # about as much as decoding them.
+        builds = (slim_build(build, ANNOTATIONS) for build in builds)
+        records = []
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            batch_size = self.CHUNK_SIZE * self.jobs
+            pending = None
+            while True:
+                batch = list(islice(builds, batch_size))
+                if pending is not None:
+                    records.extend(pending.get())
+
+                if not batch:
+                    break
 
-    def get_stats(self):
-        builds_examined = 0
-        earliest_completion = None
-        latest_completion = None
-        states = defaultdict(int)
-        tputmodel = ThroughputModel(60 * 60)
+                pending = pool.map_async(BuildRecord, batch,
+                                         chunksize=self.CHUNK_SIZE)
+        finally:
+            pool.close()
+            pool.join()
+
+        return records
+
+    def get_stats(self, saved=None):
+        """
+        Write the metrics CSV files and return a summary
+
+        saved is a dict saved from a previous run, updated in place. If
+        it is not empty only builds completed since that run are
+        processed and their rows are appended to the CSV files.
+        """
+        if saved is None:
+            saved = {}
+
+        incremental = bool(saved)
+        builds_examined = saved.get('builds examined', 0)
+        earliest_completion = saved.get('earliest_completion')
+        latest_completion = saved.get('latest_completion')
+        states = defaultdict(int, saved.get('states', {}))
+        tputmodel = ThroughputModel(THROUGHPUT_WINDOWS, saved.get('throughput'))
+        self.sketches = DurationSketches(saved.get('sketches'))
         missing = []
         results = {
             'archived': [],
@@ -94,146 +471,100 @@ class Builds(object):
             'concurrent': [],
         }
 
-        # Sort by time created
-        builds = [build for build in self.builds
-                  if 'completionTimestamp' in build['status']]
-        builds.sort(key=lambda x: x['status']['completionTimestamp'])
-
-        tput = 0
-        for build in builds:
-            upload_size_mb = 'nan'
-            name = build['metadata']['name']
-            completionTimestamp = build['status']['completionTimestamp']
-            completion = rfc3339_time(completionTimestamp)
-            timestamp = strftime("%Y-%m-%d %H:%M:%S", gmtime(completion))
+        # Decode each build once, the input may be a stream too large
+        # to hold in memory
+        watermark = saved.get('watermark')
+        watermark_names = saved.get('watermark names', [])
+        records = self.get_records(since=watermark)
+        if watermark is not None:
+            # Builds completed in the same second as the watermark may
+            # not all have been seen yet
+            processed = set(watermark_names)
+            records = [record for record in records
+                       if (record.completion > watermark or
+                           record.name not in processed)]
+
+        # Sort by time completed
+        records.sort(key=attrgetter('completion'))
+
+        # Builds which never started still move the watermark, or they
+        # would be counted again by every later run
+        if records:
+            latest = records[-1].completion
+            names = [record.name for record in records
+                     if record.completion == latest]
+            if latest == watermark:
+                names.extend(watermark_names)
+
+            watermark, watermark_names = latest, names
+
+        tput = saved.get('tput', {name: 0 for name, window in THROUGHPUT_WINDOWS})
+        for record in records:
+            completion = record.completion
             if earliest_completion is None:
                 earliest_completion = latest_completion = completion
 
             latest_completion = completion
 
-            state = build['status']['phase']
+            state = record.state
             states[state] += 1
-            creationTimestamp = build['metadata']['creationTimestamp']
-            creation = rfc3339_time(creationTimestamp)
-            startTimestamp = build['status'].get('startTimestamp')
-            if startTimestamp is None:
+            if record.start is None:
                 continue
 
-            start = rfc3339_time(startTimestamp)
-            pending = start - creation
-            if pending < 0:
-                which = 'archived'
-                pending = 'nan'
-            else:
-                which = 'current'
-
-            duration = build['status'].get('duration', 0) / 1000000000
-            plugins = {name: 'nan'
-                       for name in ['pull_base_image',
-                                    'distgit_fetch_artefacts',
-                                    'dockerfile_content',
-                                    'squash',
-                                    'compress',
-                                    'pulp_push',
-                                    'image',
-                                    'failed_plugin',
-                                    'exception']}
-
-            try:
-                plugins_metadata = json.loads(build['metadata']['annotations']['plugins-metadata'])
-                durations = plugins_metadata['durations']
-            except Exception:
-                plugins_metadata = {}
-                durations = {}
-
-            try:
-                errors = plugins_metadata['errors']
-                first_failed = sorted(errors.keys())[0]
-                plugins['failed_plugin'] = first_failed
-                exception_text = errors[first_failed].split("(")[0]
-                # Make sure commas are escaped and double quotes are replaced
-                plugins['exception'] = json.dumps(exception_text.replace('"', "'"))
-            except (KeyError, IndexError):
-                pass
-
             if state == 'Complete':
                 # Count this towards throughput
                 tput = tputmodel.append(completion)
+                if record.which == 'current':
+                    self.sketches.add(record)
 
-                if which == 'current':
-                    annotations = build['metadata'].get('annotations', {})
-                    tar_metadata = annotations.get('tar_metadata')
-                    if tar_metadata:
-                        md = json.loads(tar_metadata)
-                        upload_size_mb = md['size'] / (1024 * 1024)
-
-                    for plugin in plugins.keys():
-                        try:
-                            plugins[plugin] = durations[plugin]
-                        except KeyError:
-                            pass
-                        else:
-                            continue
-
-                    repositories = annotations.get('repositories')
-                    if repositories:
-                        repositories_json = json.loads(repositories)
-                        try:
-                            image_name = '/'.join(repositories_json['unique'][0].split('/')[1:])
-                            plugins['image'] = image_name.split(':')[0]
-                        except IndexError:
-                            plugins['image'] = ''
-
-                metrics = Metrics(name=name,
-                                  completion=timestamp,
-                                  state=state,
-                                  throughput=tput,
-                                  pending=pending,
-                                  running=duration,
-                                  upload_size_mb=upload_size_mb,
-                                  **plugins)
-                results[which].append(metrics)
-            elif state == 'Failed':
-                metrics = Metrics(name=name,
-                                  completion=timestamp,
+            if state in ('Complete', 'Failed'):
+                values = dict(zip(PLUGINS, record.plugins), **tput)
+                metrics = Metrics(name=record.name,
+                                  completion=completion,
                                   state=state,
-                                  throughput=tput,
-                                  pending=pending,
-                                  running=duration,
-                                  upload_size_mb='nan',
-                                  **plugins)
-                results[which].append(metrics)
+                                  pending=record.pending,
+                                  running=record.running,
+                                  upload_size_mb=record.upload_size_mb,
+                                  **values)
+                results[record.which].append(metrics)
 
             builds_examined += 1
 
         # Now sort by time started
-        builds = [build for build in self.builds
-                  if ('startTimestamp' in build['status'] and
-                      'completionTimestamp' in build['status'])]
-        builds.sort(key=lambda x: x['status']['startTimestamp'])
-        cmodel = ConcurrentModel()
-        for build in builds:
-            startTimestamp = build['status']['startTimestamp']
-            start = rfc3339_time(startTimestamp)
-            completionTimestamp = build['status']['completionTimestamp']
-            completion = rfc3339_time(completionTimestamp)
-            cmodel.append(start, completion)
-
-        results['concurrent'].extend(
-                [(strftime("%Y-%m-%d %H:%M:%S", gmtime(timestamp)), nbuilds)
-                 for (timestamp, nbuilds) in cmodel.get_nbuilds()])
+        records = [record for record in records if record.start is not None]
+        records.sort(key=attrgetter('start'))
+        cmodel = ConcurrentModel(saved.get('concurrency'))
+        for record in records:
+            cmodel.append(record.start, record.completion)
+
+        results['concurrent'].extend(cmodel.get_nbuilds())
 
         for which, data in results.items():
             if which == 'concurrent':
-                with open("metrics-concurrent.csv", "w") as fp:
-                    fp.write("timestamp,nbuilds\n")
-                    for result in data:
-                        fp.write(",".join([str(m) for m in result]) + '\n')
+                columns = CONCURRENT_COLUMNS
             else:
-                with open("metrics-{which}.csv".format(which=which), "w") as fp:
-                    fp.write(",".join([field[1] for field in FIELDS]) + '\n')
-                    for result in data:
-                        fp.write(",".join([str(m) for m in result]) + '\n')
+                columns = [field[1] for field in FIELDS]
+
+            filename = "metrics-{which}".format(which=which)
+            if self.output_format == 'csv':
+                write_csv(filename + '.csv', columns, data, incremental)
+            else:
+                write_columnar(filename, columns, data, incremental)
+
+        if watermark is not None:
+            saved['watermark'] = watermark
+            saved['watermark names'] = watermark_names
+
+        saved.update({
+            'builds examined': builds_examined,
+            'earliest_completion': earliest_completion,
+            'latest_completion': latest_completion,
+            'states': dict(states),
+            'tput': tput,
+            'throughput': tputmodel.get_state(),
+            'concurrency': cmodel.get_state(),
+            'sketches': self.sketches.get_state(),
+        })
 
         return {
             'builds examined': builds_examined,
@@ -241,23 +572,64 @@ class Builds(object):
             'latest_completion': ctime(latest_completion),
             'states': states,
             'missing-log': missing,
+            'concurrency': cmodel.get_stats(),
+            'durations': self.sketches.get_stats(),
         }
 
-        
-def run(inputfile=None, instance=None):
+
+def run(inputfile=None, instance=None, jobs=1, statefile=None,
+        output_format='csv', sketchfile=None, merge_sketchfiles=()):
+    state = {}
+    if statefile is not None and os.path.exists(statefile):
+        with open(statefile) as fp:
+            state = json.load(fp)
+
     if inputfile is not None:
         with open(inputfile) as fp:
-            builds = json.load(fp)
+            builds = Builds(iter_builds(fp), instance, jobs, output_format)
+            stats = builds.get_stats(state)
     else:
-        builds = json.load(sys.stdin)
+        builds = Builds(iter_builds(sys.stdin), instance, jobs, output_format)
+        stats = builds.get_stats(state)
+
+    if statefile is not None:
+        with open(statefile, 'w') as fp:
+            json.dump(state, fp)
+
+    if sketchfile is not None:
+        with open(sketchfile, 'w') as fp:
+            json.dump(builds.sketches.get_state(), fp)
+
+    if merge_sketchfiles:
+        # Fold in durations from other runs or instances
+        for merge_sketchfile in merge_sketchfiles:
+            with open(merge_sketchfile) as fp:
+                builds.sketches.merge(DurationSketches(json.load(fp)))
+
+        stats['durations'] = builds.sketches.get_stats()
 
-    print(json.dumps(Builds(builds, instance).get_stats(), sort_keys=True, indent=2))
+    print(json.dumps(stats, sort_keys=True, indent=2))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--instance")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="processes to decode builds with")
+    parser.add_argument("--incremental", metavar="STATEFILE",
+                        help="only process builds completed since the run "
+                        "which saved STATEFILE, appending to the CSV files")
+    parser.add_argument("--format", choices=['csv', 'columnar'], default='csv',
+                        help="columnar writes typed Parquet files, or .npz "
+                        "files if pyarrow is not installed")
+    parser.add_argument("--save-sketches", metavar="FILE",
+                        help="save duration percentile sketches to FILE")
+    parser.add_argument("--merge-sketches", metavar="FILE", action='append',
+                        default=[],
+                        help="include sketches saved by another run in the "
+                        "duration percentiles, may be repeated")
     parser.add_argument("inputfile", nargs='?', default=None)
     args = parser.parse_args()
 
-    run(args.inputfile, args.instance)
+    run(args.inputfile, args.instance, args.jobs, args.incremental,
+        args.format, args.save_sketches, args.merge_sketches)
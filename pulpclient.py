@@ -0,0 +1,138 @@
+"""
+Concurrent, de-duplicated HTTP GETs against the Pulp API.
+"""
+
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+
+class PulpClient(object):
+    """
+    Fetch Pulp URLs from a thread pool over one keep-alive session
+
+    Each URL is requested at most once per client; later requests for
+    it share the first response (or exception).
+
+    With record set, the status and body of each response are kept, by
+    URL path, for save_recording().
+    """
+
+    def __init__(self, jobs=8, record=False):
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.recording = {} if record else None
+        self.requests = 0
+        self.shared = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _fetch(self, url):
+        start = time.time()
+        try:
+            r = self.session.get(url)
+        except requests.RequestException:
+            with self.lock:
+                self.errors += 1
+            raise
+
+        latency = time.time() - start
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(r.content)
+            self.latencies[bisect_left(LATENCY_BUCKETS, latency)] += 1
+            if self.recording is not None:
+                path = urlsplit(url).path
+                self.recording[path] = [r.status_code, r.text]
+
+        r.raise_for_status()
+        return r
+
+    def submit(self, url, callback=None):
+        """
+        Start fetching url unless it already has been, returning a
+        Future for the response
+
+        callback is called with the response when a new fetch
+        succeeds, and is meant for prefetching whatever it refers to.
+        """
+        with self.lock:
+            try:
+                future = self.futures[url]
+                self.shared += 1
+                return future
+            except KeyError:
+                future = self.executor.submit(self._fetch, url)
+                self.futures[url] = future
+
+        if callback is not None:
+            def done(future):
+                if future.cancelled() or future.exception() is not None:
+                    return
+
+                try:
+                    callback(future.result())
+                except Exception:
+                    # Prefetching is best effort, whoever uses the
+                    # response reports any problem with it
+                    pass
+
+            future.add_done_callback(done)
+
+        return future
+
+    def get(self, url):
+        """
+        Response for url, raising requests exceptions as requests.get
+        followed by raise_for_status() would
+        """
+        return self.submit(url).result()
+
+    def get_stats(self):
+        """
+        Requests made, requests answered by one already made, connection
+        errors, bytes fetched, and a histogram of request latencies as
+        a list of [upper bound in seconds, count] (the last bound is None)
+        """
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'shared': self.shared,
+                'errors': self.errors,
+                'bytes': self.bytes,
+                'latency': [[bound, count] for bound, count
+                            in zip(LATENCY_BUCKETS + [None], self.latencies)],
+            }
+
+    def save_recording(self, path):
+        with self.lock:
+            with open(path, 'w') as fp:
+                json.dump(self.recording, fp, sort_keys=True)
+
+    def close(self):
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,80 @@
+"""
+Serve Pulp responses recorded by 'graph.py --pulp-record' so graph.py
+can be run, profiled and compared offline, against a stand-in for Pulp
+with a chosen latency.
+
+Point graph.py at it by giving http://localhost:PORT (plus any path the
+recorded pulp_base_url had) as pulp_base_url.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, recording, latency=0, jitter=0):
+        HTTPServer.__init__(self, address, ReplayHandler)
+        self.recording = recording
+        self.latency = latency
+        self.jitter = jitter
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency
+        if server.jitter:
+            delay += random.uniform(0, server.jitter)
+        time.sleep(delay)
+
+        path = self.path.split('?', 1)[0]
+        status, body = server.recording.get(path, [404, ''])
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def run(recordingfile, port, latency=0, jitter=0):
+    with open(recordingfile) as fp:
+        recording = json.load(fp)
+
+    server = ReplayServer(('localhost', port), recording, latency, jitter)
+    sys.stderr.write("Serving %s responses at http://localhost:%s\n" % (
+        len(recording), server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds to wait before each response")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="up to this many more seconds, at random")
+    parser.add_argument("recordingfile")
+    args = parser.parse_args()
+
+    run(args.recordingfile, args.port, args.latency, args.jitter)
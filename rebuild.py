@@ -0,0 +1,118 @@
+"""
+Estimate how long rebuilding a set of images takes, given how long each
+one took to build and which ones are built on which.
+"""
+
+from collections import namedtuple
+from heapq import heappop, heappush
+
+
+# Builds in the longest chain, each built on the one before, and the
+# total duration along it
+CriticalPath = namedtuple('CriticalPath', ['builds', 'duration'])
+
+
+def _topological_order(builds, dependents):
+    """
+    builds ordered so each comes after the one it is built on
+    """
+    bases = dict((build, 0) for build in builds)
+    for build in builds:
+        for dependent in dependents.get(build, ()):
+            if dependent in bases:
+                bases[dependent] += 1
+
+    order = [build for build in sorted(builds) if not bases[build]]
+    for build in order:
+        for dependent in sorted(dependents.get(build, ())):
+            if dependent in bases:
+                bases[dependent] -= 1
+                if not bases[dependent]:
+                    order.append(dependent)
+
+    if len(order) != len(bases):
+        raise RuntimeError("Dependency cycle between %s" % ', '.join(
+            sorted(build for build, count in bases.items() if count)))
+
+    return order
+
+
+def _remaining(order, dependents, duration):
+    """
+    For each build, the longest duration from its start to the end of
+    the last build which needs it, and the dependent on that chain
+    """
+    remaining = {}
+    following = {}
+    for build in reversed(order):
+        longest = 0
+        for dependent in dependents.get(build, ()):
+            if dependent in remaining and remaining[dependent] > longest:
+                longest = remaining[dependent]
+                following[build] = dependent
+
+        remaining[build] = duration.get(build, 0) + longest
+
+    return remaining, following
+
+
+def critical_path(builds, dependents, duration):
+    """
+    Longest chain of builds, by duration, which have to be built one
+    after another
+
+    dependents maps each build to the builds using it as their base,
+    and duration maps each build to its duration in seconds.
+    """
+    order = _topological_order(builds, dependents)
+    if not order:
+        return CriticalPath([], 0)
+
+    remaining, following = _remaining(order, dependents, duration)
+    build = max(order, key=lambda build: (remaining[build], build))
+    path = [build]
+    while build in following:
+        build = following[build]
+        path.append(build)
+
+    return CriticalPath(path, remaining[path[0]])
+
+
+def makespan(builds, dependents, duration, slots):
+    """
+    Time to rebuild builds with slots of them running at once
+
+    Whenever a slot is free, the ready build with the longest chain of
+    builds still to come after it is started (list scheduling). Returns
+    the total time in seconds and the start time of each build.
+    """
+    order = _topological_order(builds, dependents)
+    remaining, following = _remaining(order, dependents, duration)
+    waiting = dict((build, 0) for build in order)
+    for build in order:
+        for dependent in dependents.get(build, ()):
+            if dependent in waiting:
+                waiting[dependent] += 1
+
+    ready = []
+    for build in order:
+        if not waiting[build]:
+            heappush(ready, (-remaining[build], build))
+
+    running = []
+    starts = {}
+    now = 0
+    while ready or running:
+        while ready and len(running) < slots:
+            (priority, build) = heappop(ready)
+            starts[build] = now
+            heappush(running, (now + duration.get(build, 0), build))
+
+        (now, build) = heappop(running)
+        for dependent in dependents.get(build, ()):
+            if dependent in waiting:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    heappush(ready, (-remaining[dependent], dependent))
+
+    return now, starts
@@ -0,0 +1,116 @@
+"""
+Mergeable streaming quantile estimates, using a merging t-digest.
+"""
+
+
+class TDigest(object):
+    """
+    Approximate distribution of a stream of values
+
+    Values are kept as weighted centroids, small near the tails and
+    larger near the median, so extreme quantiles stay accurate in
+    bounded memory. Digests of separate streams can be merged.
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.centroids = []  # sorted [mean, count]
+        self.buffer = []
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        self.buffer.append([value, count])
+        self.count += count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self.buffer.extend([mean, count] for mean, count in other.centroids)
+        self.count += other.count
+        for value in (other.min, other.max):
+            if value is None:
+                continue
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        self._compress()
+
+    def _compress(self):
+        if not self.buffer:
+            return
+
+        items = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        total = float(self.count)
+        centroids = []
+        mean, count = items[0]
+        before = 0  # weight of the centroids already emitted
+        for item_mean, item_count in items[1:]:
+            # Bound centroid weight by 4nq(1-q)/compression
+            q = (before + (count + item_count) / 2.0) / total
+            if count + item_count <= 4 * total * q * (1 - q) / self.compression:
+                mean += (item_mean - mean) * item_count / float(count + item_count)
+                count += item_count
+            else:
+                centroids.append([mean, count])
+                before += count
+                mean, count = item_mean, item_count
+
+        centroids.append([mean, count])
+        self.centroids = centroids
+
+    def quantile(self, q):
+        """
+        Estimated value at quantile q (0 <= q <= 1)
+        """
+        self._compress()
+        if not self.centroids:
+            return float('nan')
+
+        target = q * self.count
+        previous_mean = self.min
+        previous_position = 0.0
+        position = 0.0
+        for mean, count in self.centroids:
+            # Each centroid's mean sits at the middle of its weight
+            centre = position + count / 2.0
+            if target < centre:
+                if centre == previous_position:
+                    return mean
+                fraction = (target - previous_position) / (centre - previous_position)
+                return previous_mean + fraction * (mean - previous_mean)
+
+            previous_mean, previous_position = mean, centre
+            position += count
+
+        if position == previous_position:
+            return self.max
+        fraction = (target - previous_position) / (position - previous_position)
+        return previous_mean + fraction * (self.max - previous_mean)
+
+    def to_dict(self):
+        self._compress()
+        return {
+            'compression': self.compression,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'centroids': self.centroids,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data['compression'])
+        digest.count = data['count']
+        digest.min = data['min']
+        digest.max = data['max']
+        digest.centroids = [list(centroid) for centroid in data['centroids']]
+        return digest
@@ -1,68 +1,648 @@
 from bokeh.plotting import *
-from bokeh.charts import Histogram, TimeSeries, BoxPlot
+from bokeh.charts import Histogram, TimeSeries
 from bokeh.models import Span, NumeralTickFormatter, AdaptiveTicker, Range1d
+import argparse
 from collections import namedtuple
 import datetime
+import hashlib
+import json
 import numpy as np
+import os
 import pandas as pd
+import re
 import sys
 
+from common import TIME_FORMAT, columnar_parts
+
 
 SINCE_DATE = datetime.date(2016, 6, 6)
 
+# Points drawn in each time-series and scatter chart, at most
+MAX_POINTS = 2000
+
+# Part of each window cache key, to change whenever the cached stats do
+CACHE_VERSION = 1
+
+
+# Windows charted by default
+DEFAULT_WINDOWS = ['2016-02-26 20:00..%s' % SINCE_DATE, '%s..' % SINCE_DATE]
+
+# A range of completion times to chart, start excluded and end included;
+# either may be None
+Window = namedtuple('Window', ['title', 'start', 'end'])
+
+# Histograms drawn for each window: column, bins, title
+HISTOGRAMS = [
+    ('running', 10, 'Total build time'),
+    ('plugin_pull_base_image', 15, 'Time pulling base image'),
+    ('plugin_distgit_fetch_artefacts', 10, 'Time fetching sources'),
+    ('docker_build', 10, 'Time in docker build'),
+    ('plugin_squash', 10, 'Time squashing layers'),
+    ('plugin_pulp_push', 10, 'Time uploading to pulp'),
+]
+
+# Columns shown in the box plot of timings for one image
+IMAGE_TIMINGS = ['running', 'plugin_pull_base_image',
+                 'plugin_distgit_fetch_artefacts', 'docker_build',
+                 'plugin_squash', 'plugin_compress', 'plugin_pulp_push']
 
-def MyHistogram(data, bins, **kwargs):
+
+def MyHistogram(counts, edges, **kwargs):
     # Work around bokeh.charts.Histogram bug
     # https://github.com/bokeh/bokeh/issues/3875
     p = figure(**kwargs)
-    hist, edges = np.histogram(data, density=False, bins=bins)
-    p.quad(top=hist, bottom=0, left=edges[:-1], right=edges[1:],
+    p.quad(top=counts, bottom=0, left=edges[:-1], right=edges[1:],
            color='#dd2222', line_color='black')
     return p
 
 
+def MyBoxPlot(boxes, **kwargs):
+    """
+    Box plot of (label, (low, q1, median, q3, high)) pairs
+    """
+    labels = [str(label) for label, stats in boxes]
+    p = figure(x_range=labels, **kwargs)
+    if boxes:
+        low, q1, median, q3, high = [np.array(column) for column
+                                     in zip(*[stats for label, stats in boxes])]
+        p.segment(labels, low, labels, high, line_color='black')
+        p.rect(labels, (q1 + q3) / 2, 0.7, q3 - q1,
+               fill_color='#dd2222', line_color='black')
+        p.rect(labels, median, 0.7, 0, line_color='black', line_width=2)
+    return p
+
+
+def parse_window(spec, latest):
+    """
+    Window for spec: either a time up to latest, such as 24h, 7d or 4w,
+    or START..END with either date (and time) left out to leave that
+    end open
+    """
+    match = re.match(r'^(\d+)([hdw])$', spec)
+    if match:
+        unit = {'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+        delta = pd.Timedelta(**{unit: int(match.group(1))})
+        return Window(' (last %s)' % spec, latest - delta, None)
+
+    try:
+        start, end = [pd.Timestamp(when) if when else None
+                      for when in spec.split('..')]
+    except ValueError:
+        raise ValueError("Cannot parse window %r" % spec)
+
+    if start is not None and end is not None:
+        title = ' (%s - %s)' % (start.strftime('%b %d'), end.strftime('%b %d'))
+    elif start is not None:
+        title = ' (since %s)' % start.strftime('%b %d')
+    elif end is not None:
+        title = ' (until %s)' % end.strftime('%b %d')
+    else:
+        title = ''
+    return Window(title, start, end)
+
+
+def sorted_pieces(values, segments, labels=None):
+    """
+    Split values into sorted arrays by segment, and by label if labels
+    are given, leaving out NaNs, returning {(segment, label): array}
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    if labels is not None:
+        valid &= pd.notnull(labels)
+        labels = np.asarray(labels)[valid]
+        codes, uniques = pd.factorize(labels, sort=True)
+    else:
+        codes = np.zeros(valid.sum(), dtype=np.int64)
+        uniques = [None]
+
+    values = values[valid]
+    segments = segments[valid]
+    order = np.lexsort((values, codes, segments))
+    values, codes, segments = values[order], codes[order], segments[order]
+    starts = np.flatnonzero((np.diff(segments) != 0) | (np.diff(codes) != 0)) + 1
+    pieces = {}
+    for piece, first in zip(np.split(values, starts), np.concatenate([[0], starts])):
+        if len(piece):
+            pieces[(segments[first], uniques[codes[first]])] = piece
+    return pieces
+
+
+def histogram(pieces, bins):
+    """
+    np.histogram() of the values of sorted arrays together
+    """
+    if not pieces:
+        return np.zeros(bins, dtype=np.int64), np.linspace(0, 1, bins + 1)
+
+    low = min(piece[0] for piece in pieces)
+    high = max(piece[-1] for piece in pieces)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    edges = np.linspace(low, high, bins + 1)
+    counts = np.zeros(bins, dtype=np.int64)
+    for piece in pieces:
+        positions = np.searchsorted(piece, edges, side='left')
+        # The last bin includes its right edge
+        positions[-1] = len(piece)
+        counts += np.diff(positions)
+    return counts, edges
+
+
+def box_stats(pieces):
+    """
+    Whiskers, quartiles and median of the values of sorted arrays
+    together, with whiskers 1.5 IQR beyond the quartiles but within
+    the values
+    """
+    values = np.concatenate(pieces)
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    low = min(piece[0] for piece in pieces)
+    high = max(piece[-1] for piece in pieces)
+    iqr = q3 - q1
+    return (max(low, q1 - 1.5 * iqr), q1, median, q3, min(high, q3 + 1.5 * iqr))
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        values = values.astype('datetime64[ns]').astype(np.int64)
+    return values.astype(float)
+
+
+def lttb(x, y, max_points):
+    """
+    Indices of at most max_points of the points of the line through x
+    and y, chosen to keep its shape (Largest-Triangle-Three-Buckets)
+    """
+    count = len(x)
+    if count <= max_points or max_points < 3:
+        return np.arange(count)
+
+    x = _as_float(x)
+    y = _as_float(y)
+    # The first and last points are kept, the rest are split into
+    # buckets and the point making the largest triangle with the point
+    # kept from the previous bucket and the mean of the next is kept
+    edges = np.linspace(1, count - 1, max_points - 1).astype(int)
+    indices = [0]
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_end = edges[bucket + 2]
+            mean_x = x[end:next_end].mean()
+            mean_y = y[end:next_end].mean()
+        else:
+            mean_x = x[-1]
+            mean_y = y[-1]
+
+        areas = np.abs((x[previous] - mean_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        indices.append(previous)
+
+    indices.append(count - 1)
+    return np.array(indices)
+
+
+def thin_scatter(x, y, max_points):
+    """
+    Indices of at most max_points of the points (x, y), one from each
+    occupied cell of a grid over them, so outliers and the shape of
+    dense areas both survive
+    """
+    count = len(x)
+    if count <= max_points:
+        return np.arange(count)
+
+    x = _as_float(x)
+    y = _as_float(y)
+    side = int(np.sqrt(max_points))
+    cells = np.zeros(count, dtype=np.int64)
+    for values, scale in [(x, side), (y, 1)]:
+        low, high = np.nanmin(values), np.nanmax(values)
+        span = (high - low) or 1
+        cell = np.clip(((values - low) / span * side).astype(np.int64), 0, side - 1)
+        cells += np.where(np.isnan(values), 0, cell) * scale
+
+    # Points with a missing value are not drawn anyway
+    drawn = ~(np.isnan(x) | np.isnan(y))
+    unique, first = np.unique(cells[drawn], return_index=True)
+    return np.sort(np.flatnonzero(drawn)[first])
+
+
+def _as_ns(values):
+    return np.asarray(values).astype('datetime64[ns]').astype(np.int64)
+
+
+def concurrency_at(timestamps, nbuilds, times):
+    """
+    Number of builds running at each of times, from the transitions of
+    that number at timestamps (sorted)
+    """
+    index = np.searchsorted(_as_ns(timestamps), _as_ns(times), side='right') - 1
+    levels = np.asarray(nbuilds)[np.maximum(index, 0)]
+    # Nothing was running before the first transition
+    return np.where(index < 0, 0, levels)
+
+
+def mean_concurrency(timestamps, nbuilds, starts, ends):
+    """
+    Mean number of builds running between each of starts and the
+    matching end, weighted by time
+    """
+    timestamps = _as_ns(timestamps)
+    nbuilds = np.asarray(nbuilds, dtype=float)
+    # Build-nanoseconds up to each transition
+    elapsed = np.concatenate([[0], np.cumsum(np.diff(timestamps) * nbuilds[:-1])])
+
+    def integral(times):
+        index = np.searchsorted(timestamps, times, side='right') - 1
+        before = index < 0
+        index = np.maximum(index, 0)
+        area = elapsed[index] + nbuilds[index] * (times - timestamps[index])
+        return np.where(before, 0, area)
+
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (integral(ends) - integral(starts)) / (ends - starts)
+    # A build taking no time sees the level when it finished
+    return np.where(ends > starts, mean,
+                    concurrency_at(timestamps, nbuilds, ends.astype(np.int64)))
+
+
+# Columns used from the metrics table and how to hold them; completion
+# is read as a timestamp
+METRICS_COLUMNS = {
+    'image': 'category',
+    'state': 'category',
+    'throughput': 'int64',
+    'running': 'float64',
+    'plugin_pull_base_image': 'float64',
+    'plugin_distgit_fetch_artefacts': 'float64',
+    'docker_build': 'float64',
+    'plugin_squash': 'float64',
+    'plugin_compress': 'float64',
+    'plugin_pulp_push': 'float64',
+    'upload_size_mb': 'float64',
+}
+CONCURRENT_COLUMNS = {
+    'nbuilds': 'int64',
+}
+
+
+def read_columnar(filename, columns=None):
+    """
+    Load a table written by 'metrics.py --format columnar', with the
+    parts appended to it, or just the named columns of it
+    """
+    tables = []
+    for part in columnar_parts(filename):
+        if part.endswith('.npz'):
+            with np.load(part) as npz:
+                columns = columns or npz.files
+                tables.append(pd.DataFrame({column: npz[column]
+                                            for column in columns},
+                                           columns=columns))
+        else:
+            tables.append(pd.read_parquet(part, columns=columns))
+
+    if len(tables) == 1:
+        return tables[0]
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def read_table(filename, dtypes, timestamp):
+    """
+    Load the columns named in dtypes, with those types, and the
+    timestamp column from a metrics.py CSV or columnar file
+    """
+    columns = [timestamp] + sorted(dtypes)
+    if filename.endswith('.csv'):
+        # metrics.py writes missing numbers as 'nan' and a missing
+        # image as an empty string
+        na_values = dict((column, ['nan'] if dtype == 'float64' else [''])
+                         for column, dtype in dtypes.items())
+        table = pd.read_csv(filename, usecols=columns,
+                            dtype=dict((column, dtype) for column, dtype in dtypes.items()
+                                       if dtype != 'category'),
+                            na_values=na_values, keep_default_na=False)
+        table[timestamp] = pd.to_datetime(table[timestamp], format=TIME_FORMAT)
+    else:
+        table = read_columnar(filename, columns)
+
+    for column, dtype in dtypes.items():
+        if dtype == 'category':
+            # Match the CSV loading, where an empty string is NA
+            table[column] = table[column].replace('', np.nan).astype('category')
+
+    return table
+
+
+def _times_to_json(times):
+    return np.asarray(times).astype('datetime64[ns]').astype(np.int64).tolist()
+
+
+def _times_from_json(times):
+    return np.array(times, dtype=np.int64).astype('datetime64[ns]')
+
+
+def stats_to_json(stats):
+    """
+    Window stats from Charts.get_window_stats() as JSON-friendly data
+    """
+    if stats is None:
+        return None
+
+    def boxes(pairs):
+        return [[label, [float(value) for value in box]] for label, box in pairs]
+
+    x, y = stats['throughput']
+    throughput = [_times_to_json(x), np.asarray(y).tolist()]
+    x, y = stats['concurrency']
+    concurrency = [_times_to_json(x), np.asarray(y).tolist()]
+    peak = stats['peak_throughput']
+    return {
+        'title': stats['title'],
+        'builds': int(stats['builds']),
+        'peak_throughput': None if peak is None else float(peak),
+        'histograms': dict((column, [counts.tolist(), edges.tolist()])
+                           for column, (counts, edges)
+                           in stats['histograms'].items()),
+        'squash_by_nbuilds': boxes(stats['squash_by_nbuilds']),
+        'running_by_mean_nbuilds': boxes(stats['running_by_mean_nbuilds']),
+        'image_timings': boxes(stats['image_timings']),
+        'throughput': throughput,
+        'pulp_push': [np.asarray(points).tolist() for points in stats['pulp_push']],
+        'concurrency': concurrency,
+    }
+
+
+def stats_from_json(data):
+    """
+    Window stats saved by stats_to_json()
+    """
+    if data is None:
+        return None
+
+    def boxes(pairs):
+        return [(label, tuple(box)) for label, box in pairs]
+
+    x, y = data['throughput']
+    throughput = (_times_from_json(x), np.array(y))
+    x, y = data['concurrency']
+    concurrency = (_times_from_json(x), np.array(y))
+    return {
+        'title': data['title'],
+        'builds': data['builds'],
+        'peak_throughput': data['peak_throughput'],
+        'histograms': dict((column, (np.array(counts), np.array(edges)))
+                           for column, (counts, edges)
+                           in data['histograms'].items()),
+        'squash_by_nbuilds': boxes(data['squash_by_nbuilds']),
+        'running_by_mean_nbuilds': boxes(data['running_by_mean_nbuilds']),
+        'image_timings': boxes(data['image_timings']),
+        'throughput': throughput,
+        'pulp_push': tuple(np.array(points, dtype=float)
+                           for points in data['pulp_push']),
+        'concurrency': concurrency,
+    }
+
+
 class Charts(object):
-    def __init__(self, metrics_file, concurrent_file):
-        self.concurrent = pd.read_csv(concurrent_file,
-                                      parse_dates=['timestamp'])
-        self.all_metrics = pd.read_csv(metrics_file,
-                                       parse_dates=['completion'],
-                                       na_values={'image': ''},
-                                       keep_default_na=False)
+    def __init__(self, metrics_file, concurrent_file, max_points=MAX_POINTS):
+        self.max_points = max_points
+        self.concurrent = read_table(concurrent_file, CONCURRENT_COLUMNS,
+                                     'timestamp')
+        self.all_metrics = read_table(metrics_file, METRICS_COLUMNS,
+                                      'completion')
+
+        # Builds running when each build finished (including the ones
+        # finishing with it), and on average while it ran
+        self.concurrent = self.concurrent.sort_values('timestamp', kind='mergesort')
+        completion = self.all_metrics['completion'].values
+        self.all_metrics['nbuilds'] = concurrency_at(
+            self.concurrent['timestamp'].values,
+            self.concurrent['nbuilds'].values, completion)
+        ends = _as_ns(completion).astype(float)
+        starts = ends - self.all_metrics['running'].values * 1e9
+        self.all_metrics['mean_nbuilds'] = mean_concurrency(
+            self.concurrent['timestamp'].values,
+            self.concurrent['nbuilds'].values, starts, ends)
+
         self.completed = self.all_metrics['state'] == 'Complete'
         self.metrics = self.all_metrics[self.completed]
 
         # Work out which image has median compressed size
-        compressed = ~np.isnan(self.metrics['plugin_compress'])
-        has_image = self.metrics['image'] != ''
-        median = np.median(self.metrics[compressed & has_image]['upload_size_mb'])
-        match = self.metrics[has_image &
-                             (np.abs(self.metrics['upload_size_mb'] -
-                                     median) < 1)]['image']
+        has_image = self.metrics[self.metrics['image'].notna()]
+        upload_size = has_image['upload_size_mb']
+        median = np.median(upload_size[has_image['plugin_compress'].notna()])
+        match = has_image['image'][np.abs(upload_size - median) < 1]
         if len(match.values) > 0:
             self.image = match.values[0]
         else:
             self.image = None
 
-    def get_time_charts(self, time_selector, suffix, width=600, height=350):
-        charts = []
+        # Windows are found by searching completion times
+        self.metrics = self.metrics.sort_values('completion', kind='mergesort')
+
+    @staticmethod
+    def _span(times, window):
+        """
+        Positions of the first of times (sorted) in window and of the
+        first after it
+        """
+        first, last = 0, len(times)
+        if window.start is not None:
+            first = np.searchsorted(times, pd.Timestamp(window.start).to_datetime64(),
+                                    side='right')
+        if window.end is not None:
+            last = np.searchsorted(times, pd.Timestamp(window.end).to_datetime64(),
+                                   side='right')
+        return first, max(first, last)
+
+    def get_window_stats(self, windows):
+        """
+        What is charted for each of windows: a dict of aggregates and
+        points to draw, or None for a window without builds
+
+        Builds are split into segments at every window boundary and each
+        column is grouped and sorted by segment (and label) once; each
+        window's histograms, box plots and peak then come from the
+        sorted pieces for the segments it covers.
+        """
+        metrics = self.metrics
+        completion = metrics['completion'].values
+        spans = [self._span(completion, window) for window in windows]
+        boundaries = np.unique([0, len(metrics)] +
+                               [position for span in spans for position in span])
+        segments = np.searchsorted(boundaries, np.arange(len(metrics)),
+                                   side='right') - 1
+
+        def grouped(column, labels=None, rows=slice(None)):
+            if labels is not None:
+                labels = labels[rows]
+            return sorted_pieces(metrics[column].values[rows], segments[rows],
+                                 labels)
+
+        throughput = grouped('throughput')
+        histograms = dict((column, grouped(column))
+                          for column in ['upload_size_mb'] +
+                          [column for column, bins, title in HISTOGRAMS])
+        squash = grouped('plugin_squash', metrics['nbuilds'].values)
+        running = grouped('running', np.round(metrics['mean_nbuilds'].values))
+        if self.image:
+            is_image = (metrics['image'] == self.image).values
+            timings = dict((column, grouped(column, rows=is_image))
+                           for column in IMAGE_TIMINGS)
+
+        timestamps = self.concurrent['timestamp'].values
+        all_stats = []
+        for window, (first, last) in zip(windows, spans):
+            if first == last:
+                all_stats.append(None)
+                continue
+
+            covered = set(range(np.searchsorted(boundaries, first),
+                                np.searchsorted(boundaries, last)))
+
+            def select(pieces):
+                # Sorted arrays for each label in this window
+                by_label = {}
+                for (segment, label), piece in pieces.items():
+                    if segment in covered:
+                        by_label.setdefault(label, []).append(piece)
+                return by_label
+
+            def boxes(pieces):
+                return [(int(label), box_stats(values))
+                        for label, values in sorted(select(pieces).items())]
+
+            rows = slice(first, last)
+            stats = {
+                'title': window.title,
+                'builds': last - first,
+                'peak_throughput': None,
+                'histograms': {},
+                'squash_by_nbuilds': boxes(squash),
+                'running_by_mean_nbuilds': boxes(running),
+                'image_timings': [],
+            }
+
+            peaks = [piece[-1] for piece in select(throughput).get(None, [])]
+            if peaks:
+                stats['peak_throughput'] = max(peaks)
 
-        selector = time_selector(self.metrics['completion'])
-        if not any(selector):
-            return charts
+            for column, bins in ([('upload_size_mb', 10)] +
+                                 [(column, bins) for column, bins, title in HISTOGRAMS]):
+                stats['histograms'][column] = histogram(
+                    select(histograms[column]).get(None, []), bins)
+
+            if self.image:
+                for column in IMAGE_TIMINGS:
+                    values = select(timings[column]).get(None)
+                    if values:
+                        stats['image_timings'].append((column, box_stats(values)))
+
+            # Points to draw
+            x = completion[rows]
+            y = metrics['throughput'].values[rows]
+            shown = thin_scatter(x, y, self.max_points)
+            stats['throughput'] = (x[shown], y[shown])
+
+            x = metrics['plugin_pulp_push'].values[rows]
+            y = metrics['upload_size_mb'].values[rows]
+            shown = thin_scatter(x, y, self.max_points)
+            stats['pulp_push'] = (x[shown], y[shown])
+
+            first_c, last_c = self._span(timestamps, window)
+            x = timestamps[first_c:last_c]
+            y = self.concurrent['nbuilds'].values[first_c:last_c]
+            shown = lttb(x, y, self.max_points)
+            stats['concurrency'] = (x[shown], y[shown])
+
+            all_stats.append(stats)
+
+        return all_stats
+
+    def get_window_key(self, window):
+        """
+        Hash of everything the stats for window are worked out from
+        """
+        digest = hashlib.sha1()
+        digest.update(json.dumps([CACHE_VERSION, window.title, self.max_points,
+                                  self.image]).encode('utf-8'))
+        first, last = self._span(self.metrics['completion'].values, window)
+        rows = self.metrics.iloc[first:last]
+        for column in ['completion', 'nbuilds', 'mean_nbuilds'] + sorted(
+                column for column, dtype in METRICS_COLUMNS.items()
+                if dtype != 'category'):
+            digest.update(np.ascontiguousarray(rows[column].values).tobytes())
+        digest.update((rows['image'] == self.image).values.tobytes())
+
+        first, last = self._span(self.concurrent['timestamp'].values, window)
+        rows = self.concurrent.iloc[first:last]
+        for column in ['timestamp', 'nbuilds']:
+            digest.update(np.ascontiguousarray(rows[column].values).tobytes())
+        return digest.hexdigest()
+
+    def get_cached_window_stats(self, windows, cachefile):
+        """
+        get_window_stats(), reusing the stats kept in cachefile for
+        windows whose builds have not changed, and keeping the stats for
+        these windows there for next time
+        """
+        cache = {}
+        if os.path.exists(cachefile):
+            with open(cachefile) as fp:
+                cache = json.load(fp)
+
+        keys = [self.get_window_key(window) for window in windows]
+        changed = [window for window, key in zip(windows, keys)
+                   if key not in cache]
+        computed = iter(self.get_window_stats(changed))
+        all_stats = []
+        kept = {}
+        for key in keys:
+            if key in cache:
+                stats = stats_from_json(cache[key])
+                kept[key] = cache[key]
+            else:
+                stats = next(computed)
+                kept[key] = stats_to_json(stats)
+
+            all_stats.append(stats)
+
+        sys.stderr.write("Window cache: %s reused, %s computed\n" % (
+            len(windows) - len(changed), len(changed)))
+        with open(cachefile, 'w') as fp:
+            json.dump(kept, fp, separators=(',', ':'))
+
+        return all_stats
+
+    def get_time_charts(self, stats, width=600, height=350):
+        """
+        Charts for one window, drawn from get_window_stats()
+        """
+        charts = []
+        suffix = stats['title']
 
         # hourly throughput
         s1 = figure(width=width, height=height, x_axis_type='datetime',
                     title='hourly throughput' + suffix)
         s1.legend.orientation = 'bottom_left'
-        s1.circle(self.metrics[selector & self.completed]['completion'],
-                  self.metrics[selector & self.completed]['throughput'],
+        completion, throughput = stats['throughput']
+        s1.circle(completion, throughput,
                   color='blue', alpha=0.2, size=12,
                   legend='hourly throughput')
-        peak = Span(location=self.metrics[selector]['throughput'].max(),
-                    dimension='width',
-                    line_color='green', line_dash='dashed', line_width=3)
-        s1.renderers.extend([peak])
+        if stats['peak_throughput'] is not None:
+            peak = Span(location=stats['peak_throughput'],
+                        dimension='width',
+                        line_color='green', line_dash='dashed', line_width=3)
+            s1.renderers.extend([peak])
         charts.append(s1)
 
         # upload size / pulp upload time
@@ -72,112 +652,85 @@ class Charts(object):
         s2.yaxis.axis_label = 'upload size (Mb)'
         s2.xaxis.formatter = NumeralTickFormatter(format="00:00:00")
         s2.xaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
-        s2.square(self.metrics[selector]['plugin_pulp_push'],
-                  self.metrics[selector]['upload_size_mb'],
+        pulp_push, upload_size = stats['pulp_push']
+        s2.square(pulp_push, upload_size,
                   color='orange', alpha=0.2, size=12)
         charts.append(s2)
 
         # concurrent builds
         s3 = figure(width=width, height=height, title='concurrent builds' + suffix,
                     x_axis_type='datetime')
-        which_c = time_selector(self.concurrent['timestamp'])
-        s3.line(self.concurrent[which_c]['timestamp'],
-                self.concurrent[which_c]['nbuilds'],
+        timestamp, nbuilds = stats['concurrency']
+        s3.line(timestamp, nbuilds,
                 line_color='green',
                 line_join='bevel')
         charts.append(s3)
 
         # squash time vs concurrent builds
-        merged = self.metrics[selector].merge(self.concurrent[which_c],
-                                              left_on=['completion'],
-                                              right_on=['timestamp'],
-                                              sort=False)
-        sc = BoxPlot(merged, values='plugin_squash', label='nbuilds',
-                     width=width, height=height,
-                     title='squash time vs (other) concurrent builds' + suffix)
-        sc._yaxis.formatter = NumeralTickFormatter(format="00:00:00")
-        sc._yaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
+        sc = MyBoxPlot(stats['squash_by_nbuilds'],
+                       plot_width=width, plot_height=height,
+                       title='squash time vs (other) concurrent builds' + suffix)
+        sc.yaxis.formatter = NumeralTickFormatter(format="00:00:00")
+        sc.yaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
         charts.append(sc)
 
+        # build time vs concurrent builds while building
+        rc = MyBoxPlot(stats['running_by_mean_nbuilds'],
+                       plot_width=width, plot_height=height,
+                       title='build time vs mean concurrent builds' + suffix)
+        rc.yaxis.formatter = NumeralTickFormatter(format="00:00:00")
+        rc.yaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
+        charts.append(rc)
+
         # upload_size_mb
-        valid = ~np.isnan(self.metrics['upload_size_mb'])
-        hsize = MyHistogram(self.metrics['upload_size_mb'][selector][valid], bins=10,
+        counts, edges = stats['histograms']['upload_size_mb']
+        hsize = MyHistogram(counts, edges,
                             title='Upload size' + suffix,
                             plot_width=width, plot_height=height)
         hsize.xaxis.axis_label = 'Mb'
         charts.append(hsize)
 
         # running time by plugin
-        these_metrics = self.metrics[selector]
-        for column, bins, title in [
-            ('running', None,
-             'Total build time' + suffix),
-
-            ('plugin_pull_base_image', 15,
-             'Time pulling base image' + suffix),
-
-            ('plugin_distgit_fetch_artefacts', None,
-             'Time fetching sources' + suffix),
-
-            ('docker_build', None,
-             'Time in docker build' + suffix),
-
-            ('plugin_squash', None,
-             'Time squashing layers' + suffix),
-
-            ('plugin_pulp_push', None,
-             'Time uploading to pulp' + suffix),
-        ]:
-            values = these_metrics[column][~np.isnan(these_metrics[column])]
-            h = MyHistogram(values, title=title, x_axis_type='datetime',
-                            bins=bins or 10, plot_width=width, plot_height=height)
+        for column, bins, title in HISTOGRAMS:
+            counts, edges = stats['histograms'][column]
+            h = MyHistogram(counts, edges, title=title + suffix,
+                            x_axis_type='datetime',
+                            plot_width=width, plot_height=height)
             h.xaxis.formatter = NumeralTickFormatter(format="00:00:00")
             h.xaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
-            h.yaxis.bounds = (0, len(these_metrics))
+            h.yaxis.bounds = (0, stats['builds'])
             charts.append(h)
 
         # Now show plugin-level timings for a specific image
-        # data looks like:
-        # completion  image       plugin_x  plugin_y
-        # 2016-03-18  image/name    205       60
-        #
-        # reshape to:
-        # imgae       plugin      value
-        # image/name  plugin_x    205
-        # image/name  plugin_y    60
         if self.image:
-            is_image = self.metrics[selector]['image'] == self.image
-            image = self.metrics[selector][is_image]
-            timings = pd.melt(image[['image',
-                                     'running',
-                                     'plugin_pull_base_image',
-                                     'plugin_distgit_fetch_artefacts',
-                                     'docker_build',
-                                     'plugin_squash',
-                                     'plugin_compress',
-                                     'plugin_pulp_push']],
-                              id_vars=['image'], var_name='plugin')
-            im = BoxPlot(timings, values='value', label='plugin',
-                         width=width, height=height * 2,
-                         title='%s timings%s' % (self.image, suffix))
-            im._yaxis.formatter = NumeralTickFormatter(format="00:00:00")
-            im._yaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
+            im = MyBoxPlot(stats['image_timings'],
+                           plot_width=width, plot_height=height * 2,
+                           title='%s timings%s' % (self.image, suffix))
+            im.yaxis.formatter = NumeralTickFormatter(format="00:00:00")
+            im.yaxis.ticker = AdaptiveTicker(mantissas=[1,3,6])
             charts.append(im)
 
         return charts
 
-    def run(self):
-        def since(x):
-            return x > SINCE_DATE
+    def get_windows(self, specs=None):
+        """
+        Windows for specs (see parse_window()), relative ones ending at
+        the last completed build
+        """
+        latest = self.metrics['completion'].max()
+        return [parse_window(spec, latest) for spec in specs or DEFAULT_WINDOWS]
+
+    def run(self, windows=None, cachefile=None):
+        if windows is None:
+            windows = self.get_windows()
 
-        def until(x):
-            return ((x > datetime.datetime(2016, 2, 26, 20, 0)) &
-                    (x <= SINCE_DATE))
+        if cachefile is not None:
+            all_stats = self.get_cached_window_stats(windows, cachefile)
+        else:
+            all_stats = self.get_window_stats(windows)
 
-        since_str = SINCE_DATE.strftime('%b %d')
-        time_charts = [self.get_time_charts(until, ' (Feb 26 - {0})'.format(since_str)),
-                       self.get_time_charts(since, ' (since {0})'.format(since_str))]
-        time_charts = [charts for charts in time_charts if charts]
+        time_charts = [self.get_time_charts(stats) for stats in all_stats
+                       if stats is not None]
         p = [hplot(*x) for x in zip(*time_charts)]
         charts = vplot(*p)
         output_file('metrics.html', mode='inline')
@@ -185,4 +738,27 @@ class Charts(object):
 
 
 if __name__ == '__main__':
-    Charts(sys.argv[1], sys.argv[2]).run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-points", type=int, default=MAX_POINTS,
+                        help="most points to draw in each time-series or "
+                        "scatter chart (default %s)" % MAX_POINTS)
+    parser.add_argument("--window", action='append', metavar='WINDOW',
+                        help="builds to chart: the last 24h, 7d, 4w etc., or "
+                        "START..END with either date left out to leave it "
+                        "open; may be given more than once (default %s)" %
+                        ' '.join(DEFAULT_WINDOWS))
+    parser.add_argument("--cache", metavar="FILE",
+                        help="keep the aggregates for each window in FILE "
+                        "and only work them out again for windows whose "
+                        "builds have changed")
+    parser.add_argument("metrics_file")
+    parser.add_argument("concurrent_file")
+    args = parser.parse_args()
+
+    charts = Charts(args.metrics_file, args.concurrent_file, args.max_points)
+    try:
+        windows = charts.get_windows(args.window)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    charts.run(windows, args.cache)
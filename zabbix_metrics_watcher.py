@@ -2,12 +2,13 @@ import argparse
 import subprocess
 import json
 import logging
-import dateutil.parser
 import datetime
 from dateutil.tz import tzutc
 from time import sleep
 from tempfile import NamedTemporaryFile
 
+from common import rfc3339_datetime
+
 logger = logging.getLogger('osbs-metrics')
 logger.handlers = []
 logger.setLevel(logging.DEBUG)
@@ -104,7 +105,7 @@ class Build(object):
     def created_time(self):
         try:
             timestamp = self._data['metadata']['creationTimestamp']
-            return dateutil.parser.parse(timestamp)
+            return rfc3339_datetime(timestamp, tzutc())
         except Exception as e:
             logger.warn('Error created_time: %r', e)
             return None
@@ -113,7 +114,7 @@ class Build(object):
     def started_time(self):
         try:
             timestamp = self._data['status']['startTimestamp']
-            return dateutil.parser.parse(timestamp)
+            return rfc3339_datetime(timestamp, tzutc())
         except Exception as e:
             logger.warn('Error started_time: %r', e)
             return None
@@ -122,7 +123,7 @@ class Build(object):
     def completed_time(self):
         try:
             timestamp = self._data['status']['completionTimestamp']
-            return dateutil.parser.parse(timestamp)
+            return rfc3339_datetime(timestamp, tzutc())
         except Exception as e:
             logger.warn('Error completed_time: %r', e)
             return None